@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Stream matplotlib frames straight into ffmpeg.
+
+Each frame is drawn on the Agg canvas and its RGBA buffer is written to an
+ffmpeg rawvideo pipe. This skips the per-frame savefig() that
+Animation.save performs. write_frames() takes the buffers from any
+iterable, e.g. frames rendered in worker processes.
+"""
+
+import subprocess
+
+
+def write_frames(frames, size, output_file, fps, bitrate, codec='libx264',
+                 extra_args=()):
+    """Encode an iterable of RGBA frame buffers to output_file.
+
+    size is the (width, height) of every frame. Frames are written as
+    they are produced, so they may come from a generator or a worker pool.
+    bitrate is in kbit/s; None leaves rate control to the encoder (x264
+    defaults to CRF 23, and a '-crf' in extra_args overrides it).
+    Raises FileNotFoundError if ffmpeg is not installed and
+    CalledProcessError if ffmpeg fails.
+    """
+    width, height = size
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+           '-f', 'rawvideo', '-pix_fmt', 'rgba',
+           '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+           # yuv420p needs even dimensions
+           '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+           '-c:v', codec, '-pix_fmt', 'yuv420p']
+    if bitrate is not None:
+        cmd += ['-b:v', f'{bitrate}k']
+    cmd += [*extra_args, output_file]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    try:
+        for frame in frames:
+            proc.stdin.write(frame)
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def write_animation(fig, update, n_frames, output_file, fps, bitrate,
+                    codec='libx264', dpi=100, extra_args=()):
+    """Render update(0..n_frames-1) on fig and encode them to output_file.
+
+    update(frame) must modify the figure in place, as for FuncAnimation.
+    extra_args are passed to ffmpeg as output options, e.g. an x264 preset.
+    Raises the same errors as write_frames.
+    """
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+
+    def frames():
+        for frame in range(n_frames):
+            update(frame)
+            fig.canvas.draw()
+            yield fig.canvas.buffer_rgba()
+
+    write_frames(frames(), fig.canvas.get_width_height(), output_file,
+                 fps, bitrate, codec, extra_args)
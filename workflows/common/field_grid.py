@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Binned field images shared by the 2D animation scripts.
+
+Field panels draw one marker per particle up to SCATTER_MAX_POINTS
+particles per frame. Larger runs show the per-cell mean on a
+FIELD_GRID x FIELD_GRID image instead: markers overlap at that density
+anyway, and one image draws far faster than a marker per particle.
+"""
+
+import numpy as np
+
+SCATTER_MAX_POINTS = 50_000
+FIELD_GRID = 128  # ~3 particles per cell at the switch-over size
+
+
+def grid_cells(x, y, extent):
+    """Return the flat index of the FIELD_GRID x FIELD_GRID cell of each particle."""
+    x0, x1, y0, y1 = extent
+    ix = ((x - x0) * (FIELD_GRID / (x1 - x0))).astype(np.intp)
+    iy = ((y - y0) * (FIELD_GRID / (y1 - y0))).astype(np.intp)
+    np.clip(ix, 0, FIELD_GRID - 1, out=ix)
+    np.clip(iy, 0, FIELD_GRID - 1, out=iy)
+    return iy * FIELD_GRID + ix
+
+
+def grid_mean(cells, values):
+    """Average values per grid cell into an image; empty cells are NaN."""
+    sums = np.bincount(cells, weights=values, minlength=FIELD_GRID**2)
+    occupancy = np.bincount(cells, minlength=FIELD_GRID**2)
+    with np.errstate(invalid='ignore'):
+        return (sums / occupancy).reshape(FIELD_GRID, FIELD_GRID)
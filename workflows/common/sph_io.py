@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Snapshot loading shared by the 2D animation scripts.
+
+Snapshots are parsed with pandas' C reader, keeping only the requested
+fields in single precision, and stacked into per-field (frame, particle)
+arrays. The stacked frames can be cached as one .npy per field and
+memory-mapped on later runs.
+"""
+
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+# Read snapshots through a 1 MiB buffer rather than the 8 KiB default
+READ_BUFFER_SIZE = 1 << 20
+
+# Column index of each field in the two snapshot layouts
+# New format: id,pos_x,pos_y,vel_x,vel_y,acc_x,acc_y,mass,density,pressure,energy,smoothing_length,sound_speed,neighbors
+NEW_FORMAT_COLUMNS = {'x': 1, 'y': 2, 'vx': 3, 'vy': 4, 'm': 7,
+                      'rho': 8, 'P': 9, 'u': 10, 'h': 11}
+# Old format: pos_x,pos_y,vel_x,vel_y,acc_x,acc_y,mass,density,pressure,energy,sound_speed,smoothing_length,...
+OLD_FORMAT_COLUMNS = {'x': 0, 'y': 1, 'vx': 2, 'vy': 3, 'm': 6,
+                      'rho': 7, 'P': 8, 'u': 9, 'h': 11}
+
+
+def find_snapshots(directory, prefix=''):
+    """Return the snapshot CSV paths in directory, ordered by output index.
+
+    The first number in each file name is compared numerically, so
+    unpadded names like snapshot_10.csv still sort after snapshot_9.csv.
+    """
+    def output_index(entry):
+        match = re.search(r'\d+', entry.name)
+        return (int(match.group()) if match else -1, entry.name)
+
+    entries = [e for e in os.scandir(directory)
+               if e.name.startswith(prefix) and e.name.endswith('.csv')]
+    entries.sort(key=output_index)
+    return [e.path for e in entries]
+
+
+def sniff_format(filename):
+    """Return the column map (new or old format) used by a snapshot file."""
+    with open(filename) as f:
+        # Skip comment lines; the first other line is the header and
+        # tells the two formats apart
+        line = f.readline()
+        while line.startswith('#'):
+            line = f.readline()
+    return NEW_FORMAT_COLUMNS if line.startswith('id,') else OLD_FORMAT_COLUMNS
+
+
+def load_snapshot(filename, columns, finite_only=False):
+    """Load a single snapshot CSV file with the given column map.
+
+    Returns a dict of float32 arrays, one per key of columns, or None if
+    the file has no rows or cannot be read. With finite_only, particles
+    with NaN or Inf in any loaded field are dropped.
+    """
+    try:
+        with open(filename, buffering=READ_BUFFER_SIZE) as f:
+            # Parse only the needed columns, in single precision (plenty
+            # for plotting); the parser skips the '#' lines and the header
+            df = pd.read_csv(f, comment='#', header=0,
+                             usecols=sorted(columns.values()),
+                             dtype=np.float32, engine='c')
+        if finite_only:
+            df = df[np.isfinite(df.to_numpy()).all(axis=1)]
+        if df.empty:
+            return None
+
+        return {name: df.iloc[:, i].to_numpy()
+                for i, name in enumerate(sorted(columns, key=columns.get))}
+    except pd.errors.EmptyDataError:
+        return None
+    except Exception as e:
+        print(f"Error loading {filename}: {e}")
+        return None
+
+
+def load_frames(snapshot_files, fields, finite_only=False):
+    """Parse all snapshots into per-field (frame, particle) arrays.
+
+    Returns a dict with 'keep' (indices of the readable files), 'counts'
+    (particles per frame) and one float32 array per entry of fields,
+    NaN-padded so frame f uses its first counts[f] entries. Returns None
+    if no snapshot could be read. finite_only is passed to load_snapshot.
+    """
+    # All snapshots of a run share one format, so detect it once
+    layout = sniff_format(snapshot_files[0])
+    columns = {name: layout[name] for name in fields}
+
+    # Files are independent, so parse them in worker processes
+    load = partial(load_snapshot, columns=columns, finite_only=finite_only)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        loaded = list(pool.map(load, snapshot_files, chunksize=8))
+
+    keep = [i for i, data in enumerate(loaded) if data is not None]
+    if not keep:
+        return None
+
+    counts = np.array([len(loaded[i][fields[0]]) for i in keep])
+    frames = {'keep': np.array(keep), 'counts': counts}
+    for name in fields:
+        values = np.full((len(keep), counts.max()), np.nan, dtype=np.float32)
+        for frame, i in enumerate(keep):
+            values[frame, :counts[frame]] = loaded[i][name]
+        frames[name] = values
+    return frames
+
+
+def load_frame_cache(cache_dir, snapshot_files, fields):
+    """Return the frames cached in cache_dir, or None if missing or out of date.
+
+    The frame arrays are memory-mapped, so only the pages actually read
+    are brought into memory.
+    """
+    try:
+        newest = max(os.path.getmtime(f) for f in snapshot_files)
+        index = os.path.join(cache_dir, 'files.npy')
+        if os.path.getmtime(index) < newest:
+            return None
+        names = [os.path.basename(f) for f in snapshot_files]
+        if np.load(index).tolist() != names:
+            return None
+        return {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+                for name in ('keep', 'counts') + tuple(fields)}
+    except (OSError, ValueError):
+        return None  # No usable cache
+
+
+def save_frame_cache(cache_dir, snapshot_files, frames):
+    """Write frames to cache_dir, tagged with the snapshot file names."""
+    names = np.array([os.path.basename(f) for f in snapshot_files])
+    # Build the cache in a temporary directory and swap it in, so a
+    # concurrent reader never sees a half-written cache
+    tmp_dir = cache_dir + '.tmp'
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, values in frames.items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), values)
+        np.save(os.path.join(tmp_dir, 'files.npy'), names)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, cache_dir)
+    except OSError as e:
+        print(f"Warning: could not write frame cache {cache_dir}: {e}")
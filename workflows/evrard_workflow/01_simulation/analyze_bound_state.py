@@ -12,83 +12,90 @@ import pandas as pd
 import numpy as np
 import sys
 
+from evrard_kernels import binding_stats
+
+SNAPSHOT_COLUMNS = ['id', 'pos_x', 'pos_y', 'pos_z', 'vel_x', 'vel_y', 'vel_z',
+                    'mass', 'density']
+
+# Per-snapshot summary returned by analyze_snapshot; a batch of snapshots
+# can be collected into one np.empty(n, dtype=SUMMARY_DTYPE) array
+SUMMARY_DTYPE = np.dtype([('time', 'f8'), ('escaping', 'i8'), ('bound', 'i8'),
+                          ('E_max', 'f8'), ('r_max', 'f8')])
+
 def analyze_snapshot(filepath):
     """Analyze binding energy for all particles in a snapshot."""
     
-    df = pd.read_csv(filepath, comment='#')
-    
-    # Extract time from header
+    # Extract time from the '#' header, then hand the same file handle to
+    # pandas positioned at the CSV column row
+    time = 0.0
     with open(filepath) as f:
-        for line in f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line.startswith('#'):
+                break
             if 'Time:' in line:
                 time = float(line.split(':')[1].strip())
-                break
+        f.seek(offset)
+        df = pd.read_csv(f, usecols=SNAPSHOT_COLUMNS, dtype=np.float64)
     
-    # Calculate quantities
-    df['r'] = np.sqrt(df['pos_x']**2 + df['pos_y']**2 + df['pos_z']**2)
-    df['v'] = np.sqrt(df['vel_x']**2 + df['vel_y']**2 + df['vel_z']**2)
-    
-    # Radial velocity (positive = outward)
-    df['v_radial'] = (df['pos_x']*df['vel_x'] + df['pos_y']*df['vel_y'] + df['pos_z']*df['vel_z']) / df['r']
+    # Pull positions/velocities into contiguous arrays once and work on
+    # raw ndarrays instead of building intermediate pandas Series
+    pos = df[['pos_x', 'pos_y', 'pos_z']].to_numpy(dtype=np.float64)
+    vel = df[['vel_x', 'vel_y', 'vel_z']].to_numpy(dtype=np.float64)
+    mass = df['mass'].to_numpy(dtype=np.float64)
+    n_particles = len(df)
     
     # Specific orbital energy: E = (1/2)*v^2 - G*M/r
     # For this simulation: G = 1, M = 1
     G = 1.0
     M = 1.0
-    df['E_specific'] = 0.5 * df['v']**2 - G * M / (df['r'] + 1e-10)
     
-    # Total energy (kinetic + potential for all particles)
-    E_kin_total = 0.5 * (df['mass'] * df['v']**2).sum()
-    E_pot_total = -(G * df['mass'] / (df['r'] + 1e-10)).sum()  # Simplified (ignores particle-particle)
+    # All reductions and the 5 most unbound particles in a single pass;
+    # E_pot is simplified (ignores particle-particle interactions)
+    (E_kin_total, E_pot_total, bound, escaping, outward,
+     E_min, E_max, r_max, v_max, top) = binding_stats(pos, vel, mass, G * M, 5)
     E_total = E_kin_total + E_pot_total
     
-    # Statistics
-    escaping = (df['E_specific'] > 0).sum()
-    bound = (df['E_specific'] < 0).sum()
-    outward = (df['v_radial'] > 0).sum()
-    
     print(f"\n{'='*60}")
     print(f"SNAPSHOT: {filepath}")
     print(f"TIME: t = {time:.4f}")
     print(f"{'='*60}")
     print(f"\nPARTICLE BINDING STATE:")
-    print(f"  Gravitationally bound (E<0):   {bound:5d} / {len(df)} ({100*bound/len(df):.1f}%)")
-    print(f"  Unbound/escaping (E>0):        {escaping:5d} / {len(df)} ({100*escaping/len(df):.1f}%)")
-    print(f"  Moving outward (v_r>0):        {outward:5d} / {len(df)} ({100*outward/len(df):.1f}%)")
+    print(f"  Gravitationally bound (E<0):   {bound:5d} / {n_particles} ({100*bound/n_particles:.1f}%)")
+    print(f"  Unbound/escaping (E>0):        {escaping:5d} / {n_particles} ({100*escaping/n_particles:.1f}%)")
+    print(f"  Moving outward (v_r>0):        {outward:5d} / {n_particles} ({100*outward/n_particles:.1f}%)")
     
     print(f"\nENERGY STATISTICS:")
-    print(f"  Max specific energy:     {df['E_specific'].max():10.4f}")
-    print(f"  Min specific energy:     {df['E_specific'].min():10.4f}")
+    print(f"  Max specific energy:     {E_max:10.4f}")
+    print(f"  Min specific energy:     {E_min:10.4f}")
     print(f"  Total kinetic energy:    {E_kin_total:10.4f}")
     print(f"  Total potential energy:  {E_pot_total:10.4f}")
     print(f"  Total energy (approx):   {E_total:10.4f}")
     
     print(f"\nSPATIAL DISTRIBUTION:")
-    print(f"  Max radius:              {df['r'].max():10.4f}")
-    print(f"  Max velocity:            {df['v'].max():10.4f}")
+    print(f"  Max radius:              {r_max:10.4f}")
+    print(f"  Max velocity:            {v_max:10.4f}")
     print(f"  Max density:             {df['density'].max():10.2f}")
     
     if escaping > 0:
         print(f"\n⚠️  WARNING: {escaping} particles are UNBOUND and will escape!")
         print(f"   This indicates a problem with energy conservation.")
         
-        # Show worst offenders
-        worst = df.nlargest(5, 'E_specific')[['id', 'r', 'v', 'E_specific']]
+        # Show worst offenders, already selected by the kernel
+        r = np.sqrt(np.einsum('ij,ij->i', pos[top], pos[top]))
+        v2 = np.einsum('ij,ij->i', vel[top], vel[top])
+        E_specific = 0.5 * v2 - G * M / (r + 1e-10)
+        ids = df['id'].to_numpy()[top]
         print(f"\n   Top 5 most unbound particles:")
-        for _, row in worst.iterrows():
-            print(f"     ID {int(row['id']):4d}: r={row['r']:6.3f}, v={row['v']:6.3f}, E={row['E_specific']:8.4f}")
+        for j in range(len(top)):
+            print(f"     ID {int(ids[j]):4d}: r={r[j]:6.3f}, v={np.sqrt(v2[j]):6.3f}, E={E_specific[j]:8.4f}")
     else:
         print(f"\n✓ All particles are gravitationally bound (physically correct)")
-        if outward > len(df) * 0.1:
+        if outward > n_particles * 0.1:
             print(f"  {outward} particles moving outward is NORMAL during rebound phase")
     
-    return {
-        'time': time,
-        'escaping': escaping,
-        'bound': bound,
-        'E_max': df['E_specific'].max(),
-        'r_max': df['r'].max()
-    }
+    return np.array((time, escaping, bound, E_max, r_max), dtype=SUMMARY_DTYPE)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
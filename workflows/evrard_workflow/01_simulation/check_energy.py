@@ -7,6 +7,16 @@ Computes E_total = KE + IE + PE at each snapshot.
 import numpy as np
 import glob
 import os
+from multiprocessing import Pool
+
+from evrard_kernels import energy_totals, limit_kernel_threads
+from snapshot_cache import load_snapshot_table
+
+CHUNK_ROWS = 100_000  # Particles reduced per block
+
+# One row per snapshot; rows for files that failed to load stay NaN
+ENERGY_DTYPE = np.dtype([('KE', 'f8'), ('IE', 'f8'), ('PE', 'f8'),
+                         ('E_total', 'f8')])
 
 def compute_total_energy(filepath):
     """
@@ -17,40 +27,42 @@ def compute_total_energy(filepath):
     id,pos_x,pos_y,pos_z,vel_x,vel_y,vel_z,acc_x,acc_y,acc_z,
     mass,density,pressure,energy,smoothing_length,sound_speed,potential,neighbors
     """
-    # Skip header lines starting with # AND the column name line
-    with open(filepath, 'r') as f:
-        lines = [line for line in f if not line.startswith('#')]
-    
-    # First non-comment line is column headers, skip it
-    data = np.loadtxt(lines[1:], delimiter=',')
-    
-    # Extract columns (0-indexed)
-    # id=0, pos=(1,2,3), vel=(4,5,6), acc=(7,8,9), 
-    # mass=10, density=11, pressure=12, energy=13, 
-    # sml=14, sound=15, potential=16, neighbors=17
-    
-    mass = data[:, 10]
-    vel_x = data[:, 4]
-    vel_y = data[:, 5]
-    vel_z = data[:, 6]
-    ene = data[:, 13]  # Specific internal energy u
-    phi = data[:, 16]  # Gravitational potential
-    
-    # Kinetic energy
-    v_squared = vel_x**2 + vel_y**2 + vel_z**2
-    KE = np.sum(0.5 * mass * v_squared)
+    # Parsed once, then memory-mapped from the .npy cache on later runs
+    table = load_snapshot_table(filepath)
     
-    # Internal energy
-    IE = np.sum(mass * ene)
-    
-    # Gravitational potential energy
-    # Factor of 0.5 to avoid double counting (each pair counted twice)
-    PE = 0.5 * np.sum(mass * phi)
+    # Stream the table in row blocks so only one block of particles is
+    # paged in at a time; the kernel reads the fields in place
+    KE = IE = PE = 0.0
+    for start in range(0, len(table), CHUNK_ROWS):
+        block = table[start:start + CHUNK_ROWS]
+        mass = block['mass']
+        ene = block['energy']  # Specific internal energy u
+        phi = block['potential']  # Gravitational potential
+        
+        # KE, IE and PE in one pass; PE carries the factor 0.5 to avoid
+        # double counting (each pair counted twice)
+        ke, ie, pe = energy_totals(block['vel_x'], block['vel_y'], block['vel_z'],
+                                   mass, ene, phi)
+        KE += ke
+        IE += ie
+        PE += pe
     
     E_total = KE + IE + PE
     
     return KE, IE, PE, E_total
 
+def _init_worker():
+    # Snapshots are spread across processes; one kernel thread each avoids
+    # oversubscribing the cores
+    limit_kernel_threads(1)
+
+def _try_total_energy(filepath):
+    """Pool task: return (energies, None) or (None, error message)."""
+    try:
+        return compute_total_energy(filepath), None
+    except Exception as e:
+        return None, str(e)
+
 def main():
     # Find all snapshot files
     snapshot_dir = "output/evrard_collapse/snapshots"
@@ -69,10 +81,19 @@ def main():
     print("=" * 85)
     
     E_initial = None
+    summary = np.full(len(files), np.nan, dtype=ENERGY_DTYPE)
     
-    for i, filepath in enumerate(files):
-        try:
-            KE, IE, PE, E_total = compute_total_energy(filepath)
+    # Snapshots are independent: reduce them in parallel worker processes
+    # and print the results in file order as they arrive
+    with Pool(initializer=_init_worker) as pool:
+        results = pool.imap(_try_total_energy, files, chunksize=4)
+        for i, (filepath, (energies, error)) in enumerate(zip(files, results)):
+            if error is not None:
+                print(f"Error processing {filepath}: {error}")
+                continue
+            
+            summary[i] = energies
+            KE, IE, PE, E_total = energies
             
             if E_initial is None:
                 E_initial = E_total
@@ -82,14 +103,13 @@ def main():
             
             filename = os.path.basename(filepath)
             print(f"{filename:<15} {KE:>12.6f} {IE:>12.6f} {PE:>12.6f} {E_total:>12.6f} {delta_frac:>9.3f}%")
-            
-        except Exception as e:
-            print(f"Error processing {filepath}: {e}")
     
     print("\nEnergy conservation summary:")
     print(f"  Initial energy E_0 = {E_initial:.6f}")
     if len(files) > 1:
-        KE_f, IE_f, PE_f, E_final = compute_total_energy(files[-1])
+        E_final = summary['E_total'][-1]
+        if np.isnan(E_final):
+            E_final = compute_total_energy(files[-1])[3]
         print(f"  Final energy   E_f = {E_final:.6f}")
         print(f"  Relative error ΔE/E_0 = {(E_final - E_initial)/E_initial * 100:.3f}%")
         
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Fused per-particle reductions shared by the Evrard analysis scripts.
+
+Each kernel makes a single streaming pass over the particle arrays and
+returns all the scalars the scripts print. Numba is used when installed;
+otherwise an equivalent NumPy implementation is used.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange, set_num_threads
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# Softening added to r in the point-mass potential (matches analyze_bound_state)
+R_SOFTENING = 1e-10
+
+# Independent chunks binding_stats splits the particles into, each with its
+# own top-k candidates
+TOPK_CHUNKS = 256
+
+
+def limit_kernel_threads(n_threads):
+    """Cap the threads used by the parallel kernels (no-op without Numba).
+
+    Call this in worker processes that already split work across cores.
+    """
+    if HAVE_NUMBA:
+        set_num_threads(n_threads)
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True, nogil=True)
+    def energy_totals(vx, vy, vz, mass, ene, phi):
+        """Return (KE, IE, PE) summed over all particles.
+
+        Takes one 1-D array per column, so strided field views of a
+        snapshot table can be passed without copying.
+        """
+        KE = 0.0
+        IE = 0.0
+        PE = 0.0
+        for i in prange(mass.shape[0]):
+            m = mass[i]
+            KE += 0.5 * m * (vx[i] * vx[i] + vy[i] * vy[i] + vz[i] * vz[i])
+            IE += m * ene[i]
+            PE += 0.5 * m * phi[i]
+        return KE, IE, PE
+
+    @njit(parallel=True, fastmath=True, cache=True, nogil=True)
+    def binding_stats(pos, vel, mass, GM, k):
+        """Return binding-energy statistics for a point mass GM at the origin.
+
+        Returns: (E_kin, E_pot, n_bound, n_escape, n_outward,
+                  E_min, E_max, r_max, v_max, top)
+        where top holds the row indices of the k particles with the
+        highest specific energy, most unbound first.
+        """
+        n = mass.shape[0]
+        k = max(min(k, n), 1)
+        # Each chunk keeps its own top-k so the parallel loop needs no
+        # shared state; the candidates are merged serially afterwards
+        n_chunks = max(min(n, TOPK_CHUNKS), 1)
+        chunk = (n + n_chunks - 1) // n_chunks
+        top_E = np.full((n_chunks, k), -np.inf)
+        top_i = np.full((n_chunks, k), -1)
+        # Per-chunk partials, combined serially below:
+        # sums = (E_kin, E_pot), counts = (bound, escape, outward),
+        # extrema = (E_min, E_max, r_max, v2_max)
+        sums = np.zeros((n_chunks, 2))
+        counts = np.zeros((n_chunks, 3), dtype=np.int64)
+        extrema = np.empty((n_chunks, 4))
+
+        for c in prange(n_chunks):
+            c_kin = 0.0
+            c_pot = 0.0
+            c_bound = 0
+            c_escape = 0
+            c_outward = 0
+            c_E_min = np.inf
+            c_E_max = -np.inf
+            c_r_max = 0.0
+            c_v2_max = 0.0
+            slot = 0  # Weakest entry of this chunk's top-k
+            for i in range(c * chunk, min((c + 1) * chunk, n)):
+                px = pos[i, 0]
+                py = pos[i, 1]
+                pz = pos[i, 2]
+                vx = vel[i, 0]
+                vy = vel[i, 1]
+                vz = vel[i, 2]
+                r = np.sqrt(px * px + py * py + pz * pz)
+                v2 = vx * vx + vy * vy + vz * vz
+                inv_r = 1.0 / (r + R_SOFTENING)
+                E = 0.5 * v2 - GM * inv_r
+
+                c_kin += 0.5 * mass[i] * v2
+                c_pot -= GM * mass[i] * inv_r
+                if E < 0.0:
+                    c_bound += 1
+                elif E > 0.0:
+                    c_escape += 1
+                # Sign of v_r = (r . v)/r is the sign of r . v
+                if px * vx + py * vy + pz * vz > 0.0:
+                    c_outward += 1
+                c_E_min = min(c_E_min, E)
+                c_E_max = max(c_E_max, E)
+                c_r_max = max(c_r_max, r)
+                c_v2_max = max(c_v2_max, v2)
+
+                if E > top_E[c, slot]:
+                    top_E[c, slot] = E
+                    top_i[c, slot] = i
+                    for j in range(k):
+                        if top_E[c, j] < top_E[c, slot]:
+                            slot = j
+
+            sums[c, 0] = c_kin
+            sums[c, 1] = c_pot
+            counts[c, 0] = c_bound
+            counts[c, 1] = c_escape
+            counts[c, 2] = c_outward
+            extrema[c, 0] = c_E_min
+            extrema[c, 1] = c_E_max
+            extrema[c, 2] = c_r_max
+            extrema[c, 3] = c_v2_max
+
+        cand_E = top_E.ravel()
+        cand_i = top_i.ravel()
+        top = cand_i[np.argsort(-cand_E)[:k]]
+        return (sums[:, 0].sum(), sums[:, 1].sum(),
+                counts[:, 0].sum(), counts[:, 1].sum(), counts[:, 2].sum(),
+                extrema[:, 0].min(), extrema[:, 1].max(),
+                extrema[:, 2].max(), np.sqrt(extrema[:, 3].max()),
+                top[top >= 0])
+
+else:
+    def energy_totals(vx, vy, vz, mass, ene, phi):
+        """Return (KE, IE, PE) summed over all particles.
+
+        Takes one 1-D array per column, so strided field views of a
+        snapshot table can be passed without copying.
+        """
+        KE = 0.5 * (np.dot(mass * vx, vx) + np.dot(mass * vy, vy)
+                    + np.dot(mass * vz, vz))
+        IE = np.dot(mass, ene)
+        PE = 0.5 * np.dot(mass, phi)
+        return KE, IE, PE
+
+    def binding_stats(pos, vel, mass, GM, k):
+        """Return binding-energy statistics for a point mass GM at the origin.
+
+        Returns: (E_kin, E_pot, n_bound, n_escape, n_outward,
+                  E_min, E_max, r_max, v_max, top)
+        where top holds the row indices of the k particles with the
+        highest specific energy, most unbound first.
+        """
+        r = np.sqrt(np.einsum('ij,ij->i', pos, pos))
+        v2 = np.einsum('ij,ij->i', vel, vel)
+        inv_r = 1.0 / (r + R_SOFTENING)
+        E = 0.5 * v2 - GM * inv_r
+        k = min(k, E.size)
+        top = np.argpartition(E, -k)[-k:] if k > 0 else np.empty(0, dtype=np.intp)
+        top = top[np.argsort(E[top])[::-1]]
+        return (0.5 * np.dot(mass, v2),
+                -GM * np.dot(mass, inv_r),
+                np.count_nonzero(E < 0),
+                np.count_nonzero(E > 0),
+                np.count_nonzero(np.einsum('ij,ij->i', pos, vel) > 0),
+                E.min(), E.max(), r.max(), np.sqrt(v2.max()), top)
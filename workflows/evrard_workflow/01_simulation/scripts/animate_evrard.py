@@ -6,50 +6,34 @@ Generates visualization of the collapse process.
 
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation, FFMpegWriter
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import os
 import sys
 
+# Shared snapshot cache lives next to the analysis scripts, and the video
+# writer in workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'common'))
+from snapshot_cache import load_snapshot_table
+from ffmpeg_pipe import write_animation
+
 # Configuration
 RESULTS_DIR = "../output/evrard_collapse/snapshots"
 ANIMATIONS_DIR = "../results/analysis/animations"
 OUTPUT_FILE = os.path.join(ANIMATIONS_DIR, "evrard_collapse.mp4")
 
 def load_snapshot(filename):
-    """Load a single snapshot CSV file."""
+    """Load a single snapshot CSV file (memory-mapped from its .npy cache).
+
+    Returns the structured table itself; fields are the CSV column names.
+    """
     try:
-        # Count header lines to skip (comment lines + header row)
-        skip_lines = 0
-        with open(filename) as f:
-            for line in f:
-                if line.startswith('#'):
-                    skip_lines += 1
-                else:
-                    # First non-comment line is the header
-                    skip_lines += 1
-                    break
-        
-        data = np.loadtxt(filename, delimiter=',', skiprows=skip_lines)
-        if data.size == 0:
+        table = load_snapshot_table(filename)
+        if table.size == 0:
             return None
-        
-        # Actual CSV columns: id, pos_x, pos_y, pos_z, vel_x, vel_y, vel_z, 
-        #                     acc_x, acc_y, acc_z, mass, density, pressure, 
-        #                     energy, smoothing_length, sound_speed, neighbors
-        if data.ndim == 1:
-            data = data.reshape(1, -1)
-        
-        return {
-            'x': data[:, 1],   # pos_x
-            'y': data[:, 2],   # pos_y
-            'z': data[:, 3],   # pos_z
-            'rho': data[:, 11], # density
-            'P': data[:, 12],  # pressure
-            'h': data[:, 14],  # smoothing_length
-            'm': data[:, 10],  # mass
-            'u': data[:, 13]   # energy
-        }
+        return table
     except Exception as e:
         print(f"Error loading {filename}: {e}")
         return None
@@ -70,80 +54,115 @@ def main():
     
     print(f"Found {len(snapshot_files)} snapshots")
     
-    # Load all snapshots
-    snapshots = []
-    times = []
-    for i, filename in enumerate(snapshot_files):
-        data = load_snapshot(filename)
-        if data is not None:
-            snapshots.append(data)
-            # Extract time from filename or use index
-            times.append(i * 0.01)  # Adjust based on actual output frequency
-    
-    if not snapshots:
+    # The first readable snapshot fixes the particle count
+    first = None
+    for start, filename in enumerate(snapshot_files):
+        first = load_snapshot(filename)
+        if first is not None:
+            break
+    
+    if first is None:
         print("Error: Failed to load any snapshots")
         sys.exit(1)
     
-    print(f"Loaded {len(snapshots)} valid snapshots")
+    # Load all snapshots into per-field (frame, particle) arrays. pandas
+    # releases the GIL while parsing, so threads overlap the CSV reads.
+    # float32 is plenty for plotting and halves what matplotlib copies.
+    n_particles = len(first)
+    X, Y, RHO, P = (np.empty((len(snapshot_files), n_particles), dtype=np.float32)
+                    for _ in range(4))
+    
+    # Per-frame extrema of (x, y, rho, P), taken while each row is fresh
+    # in cache; unread frames keep +/-inf and drop out of the reduction
+    lo = np.full((len(snapshot_files), 4), np.inf)
+    hi = np.full((len(snapshot_files), 4), -np.inf)
+    
+    def fill(i):
+        data = load_snapshot(snapshot_files[i])
+        if data is None:
+            return False
+        if len(data) != n_particles:
+            print(f"Skipping {snapshot_files[i]}: {len(data)} particles, expected {n_particles}")
+            return False
+        X[i] = data['pos_x']
+        Y[i] = data['pos_y']
+        RHO[i] = data['density']
+        P[i] = data['pressure']
+        for k, row in enumerate((X[i], Y[i], RHO[i], P[i])):
+            lo[i, k] = row.min()
+            hi[i, k] = row.max()
+        return True
+    
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        valid = list(pool.map(fill, range(start, len(snapshot_files))))
+    
+    keep = start + np.flatnonzero(valid)
+    if len(keep) < len(snapshot_files):
+        X, Y, RHO, P = X[keep], Y[keep], RHO[keep], P[keep]
+    n_frames = len(keep)
+    
+    # Extract time from filename or use index
+    times = [i * 0.01 for i in keep]  # Adjust based on actual output frequency
+    
+    print(f"Loaded {n_frames} valid snapshots")
     
     # Set up the figure for 3D projection in 2D (x-y plane)
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
     
-    # Find global min/max for consistent scaling
-    all_x = np.concatenate([s['x'] for s in snapshots])
-    all_y = np.concatenate([s['y'] for s in snapshots])
-    all_rho = np.concatenate([s['rho'] for s in snapshots])
-    all_P = np.concatenate([s['P'] for s in snapshots])
+    # Global min/max for consistent scaling
+    x_min, y_min, rho_min, P_min = lo.min(axis=0)
+    x_max, y_max, rho_max, P_max = hi.max(axis=0)
+    x_range = [x_min * 1.1, x_max * 1.1]
+    y_range = [y_min * 1.1, y_max * 1.1]
+    rho_range = [rho_min, rho_max]
+    P_range = [P_min, P_max]
+    
+    # Build the artists once; update() only swaps their data
+    # Plot density (x-y projection)
+    sc1 = ax1.scatter(X[0], Y[0], c=RHO[0], 
+                     s=20, cmap='viridis', alpha=0.6,
+                     vmin=rho_range[0], vmax=rho_range[1])
+    ax1.set_xlabel('x')
+    ax1.set_ylabel('y')
+    ax1.set_xlim(x_range)
+    ax1.set_ylim(y_range)
+    ax1.set_aspect('equal')
+    plt.colorbar(sc1, ax=ax1, label='Density')
     
-    x_range = [all_x.min() * 1.1, all_x.max() * 1.1]
-    y_range = [all_y.min() * 1.1, all_y.max() * 1.1]
-    rho_range = [all_rho.min(), all_rho.max()]
-    P_range = [all_P.min(), all_P.max()]
+    # Plot pressure (x-y projection)
+    sc2 = ax2.scatter(X[0], Y[0], c=P[0], 
+                     s=20, cmap='plasma', alpha=0.6,
+                     vmin=P_range[0], vmax=P_range[1])
+    ax2.set_xlabel('x')
+    ax2.set_ylabel('y')
+    ax2.set_xlim(x_range)
+    ax2.set_ylim(y_range)
+    ax2.set_aspect('equal')
+    plt.colorbar(sc2, ax=ax2, label='Pressure')
+    
+    title = fig.suptitle('', fontsize=14, fontweight='bold')
     
     def update(frame):
         """Update function for animation."""
-        ax1.clear()
-        ax2.clear()
-        
-        data = snapshots[frame]
         time = times[frame]
         
-        # Plot density (x-y projection)
-        sc1 = ax1.scatter(data['x'], data['y'], c=data['rho'], 
-                         s=20, cmap='viridis', alpha=0.6,
-                         vmin=rho_range[0], vmax=rho_range[1])
-        ax1.set_xlabel('x')
-        ax1.set_ylabel('y')
+        # Both panels share the same particle positions
+        offsets = np.column_stack((X[frame], Y[frame]))
+        
+        sc1.set_offsets(offsets)
+        sc1.set_array(RHO[frame])
         ax1.set_title(f'Density (t = {time:.3f})')
-        ax1.set_xlim(x_range)
-        ax1.set_ylim(y_range)
-        ax1.set_aspect('equal')
-        plt.colorbar(sc1, ax=ax1, label='Density')
         
-        # Plot pressure (x-y projection)
-        sc2 = ax2.scatter(data['x'], data['y'], c=data['P'], 
-                         s=20, cmap='plasma', alpha=0.6,
-                         vmin=P_range[0], vmax=P_range[1])
-        ax2.set_xlabel('x')
-        ax2.set_ylabel('y')
+        sc2.set_offsets(offsets)
+        sc2.set_array(P[frame])
         ax2.set_title(f'Pressure (t = {time:.3f})')
-        ax2.set_xlim(x_range)
-        ax2.set_ylim(y_range)
-        ax2.set_aspect('equal')
-        plt.colorbar(sc2, ax=ax2, label='Pressure')
         
-        fig.suptitle(f'Evrard Collapse Simulation - Frame {frame+1}/{len(snapshots)}', 
-                    fontsize=14, fontweight='bold')
-    
-    # Create animation
-    print("Creating animation...")
-    anim = FuncAnimation(fig, update, frames=len(snapshots), 
-                        interval=100, repeat=True)
+        title.set_text(f'Evrard Collapse Simulation - Frame {frame+1}/{n_frames}')
+        return sc1, sc2, title
     
-    # Save animation
+    # Render frames straight into an ffmpeg rawvideo pipe
     print(f"Saving animation to {OUTPUT_FILE}...")
-    writer = FFMpegWriter(fps=10, bitrate=1800)
-    anim.save(OUTPUT_FILE, writer=writer, dpi=100)
+    write_animation(fig, update, n_frames, OUTPUT_FILE, fps=10, bitrate=1800, dpi=100)
     
     print(f"✓ Animation saved: {OUTPUT_FILE}")
     plt.close()
@@ -9,37 +9,49 @@ import matplotlib
 matplotlib.use('Agg')  # Non-interactive backend
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.animation import FuncAnimation, FFMpegWriter
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import os
 import sys
 
+# Shared snapshot cache lives next to the analysis scripts, and the video
+# writer in workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'common'))
+from snapshot_cache import load_snapshot_table
+from ffmpeg_pipe import write_animation
+
 # Configuration
 OUTPUT_DIR = "../output/evrard_collapse/snapshots"
 ANIMATIONS_DIR = "../results/analysis/animations"
 OUTPUT_FILE = os.path.join(ANIMATIONS_DIR, "evrard_collapse_3d.mp4")
+ROTATION_STEP = 4  # Re-aim the 3D camera every this many frames
 
 def load_snapshot(filename):
-    """Load a single snapshot CSV file."""
+    """Load a single snapshot CSV file (memory-mapped from its .npy cache).
+
+    Returns the structured table itself; fields are the CSV column names.
+    """
     try:
-        # Skip comment lines starting with '#'
-        df = pd.read_csv(filename, comment='#')
-        
-        return {
-            'x': df['pos_x'].values,
-            'y': df['pos_y'].values,
-            'z': df['pos_z'].values,
-            'rho': df['density'].values,
-            'P': df['pressure'].values,
-            'h': df['smoothing_length'].values,
-            'm': df['mass'].values,
-            'u': df['energy'].values
-        }
+        return load_snapshot_table(filename)
     except Exception as e:
         print(f"Error loading {filename}: {e}")
         return None
 
+def finite_extrema(values):
+    """Return (min, max) of the finite entries, or (inf, -inf) if none."""
+    lo, hi = values.min(), values.max()
+    # min/max propagate NaN and land on +/-inf, so finite results mean the
+    # whole row is finite and no mask copy is needed
+    if np.isfinite(lo) and np.isfinite(hi):
+        return lo, hi
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return np.inf, -np.inf
+    return values.min(), values.max()
+
 def extract_time_from_energy_file():
     """Extract time information from energy.csv file."""
     energy_file = "../output/evrard_collapse/energy.csv"
@@ -71,24 +83,59 @@ def main():
     # Try to get actual times from energy file
     times_from_energy = extract_time_from_energy_file()
     
-    # Load all snapshots
-    snapshots = []
-    times = []
-    for i, filename in enumerate(snapshot_files):
-        data = load_snapshot(filename)
-        if data is not None:
-            snapshots.append(data)
-            # Use actual time if available, otherwise estimate
-            if times_from_energy is not None and i < len(times_from_energy):
-                times.append(times_from_energy[i])
-            else:
-                times.append(i * 0.1)  # Estimate based on output frequency
-    
-    if not snapshots:
+    # The first readable snapshot fixes the particle count
+    first = None
+    for start, filename in enumerate(snapshot_files):
+        first = load_snapshot(filename)
+        if first is not None:
+            break
+    
+    if first is None:
         print("Error: Failed to load any snapshots")
         sys.exit(1)
     
-    print(f"Loaded {len(snapshots)} valid snapshots")
+    # Load all snapshots into per-field (frame, particle) arrays. pandas
+    # releases the GIL while parsing, so threads overlap the CSV reads.
+    # float32 is plenty for plotting and halves what matplotlib copies.
+    n_particles = len(first)
+    X, Y, Z, RHO = (np.empty((len(snapshot_files), n_particles), dtype=np.float32)
+                    for _ in range(4))
+    
+    # Per-frame finite extrema of (x, y, z, rho), taken while each row is
+    # fresh in cache; unread frames keep +/-inf and drop out of the reduction
+    lo = np.full((len(snapshot_files), 4), np.inf)
+    hi = np.full((len(snapshot_files), 4), -np.inf)
+    
+    def fill(i):
+        data = load_snapshot(snapshot_files[i])
+        if data is None:
+            return False
+        if len(data) != n_particles:
+            print(f"Skipping {snapshot_files[i]}: {len(data)} particles, expected {n_particles}")
+            return False
+        X[i] = data['pos_x']
+        Y[i] = data['pos_y']
+        Z[i] = data['pos_z']
+        RHO[i] = data['density']
+        for k, row in enumerate((X[i], Y[i], Z[i], RHO[i])):
+            lo[i, k], hi[i, k] = finite_extrema(row)
+        return True
+    
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        valid = list(pool.map(fill, range(start, len(snapshot_files))))
+    
+    keep = start + np.flatnonzero(valid)
+    if len(keep) < len(snapshot_files):
+        X, Y, Z, RHO = X[keep], Y[keep], Z[keep], RHO[keep]
+    n_frames = len(keep)
+    
+    # Use actual time if available, otherwise estimate
+    times = [times_from_energy[i]
+             if times_from_energy is not None and i < len(times_from_energy)
+             else i * 0.1  # Estimate based on output frequency
+             for i in keep]
+    
+    print(f"Loaded {n_frames} valid snapshots")
     
     # Set up the figure for 3D visualization
     fig = plt.figure(figsize=(16, 12))
@@ -99,110 +146,110 @@ def main():
     ax_xz = fig.add_subplot(223)
     ax_yz = fig.add_subplot(224)
     
-    # Find global min/max for consistent scaling
-    all_x = np.concatenate([s['x'] for s in snapshots])
-    all_y = np.concatenate([s['y'] for s in snapshots])
-    all_z = np.concatenate([s['z'] for s in snapshots])
-    all_rho = np.concatenate([s['rho'] for s in snapshots])
-    
-    # Remove NaN and Inf values
-    all_x = all_x[np.isfinite(all_x)]
-    all_y = all_y[np.isfinite(all_y)]
-    all_z = all_z[np.isfinite(all_z)]
-    all_rho = all_rho[np.isfinite(all_rho)]
+    # Global min/max for consistent scaling, ignoring NaN and Inf values
+    lo, hi = lo.min(axis=0), hi.max(axis=0)
     
-    if len(all_x) == 0 or len(all_y) == 0 or len(all_z) == 0:
+    if not np.isfinite(lo[:3]).all():
         print("Error: No valid coordinate data found")
         sys.exit(1)
     
-    coord_max = max(np.abs(all_x).max(), np.abs(all_y).max(), np.abs(all_z).max()) * 1.1
-    rho_range = [all_rho.min(), all_rho.max()] if len(all_rho) > 0 else [0, 1]
+    coord_max = max(np.abs(lo[:3]).max(), np.abs(hi[:3]).max()) * 1.1
+    rho_range = [lo[3], hi[3]] if np.isfinite(lo[3]) else [0, 1]
     
     print(f"Coordinate range: ±{coord_max:.3f}")
     print(f"Density range: [{rho_range[0]:.6f}, {rho_range[1]:.6f}]")
     
+    # Build the artists once; update() only swaps their data. Marker edges
+    # are left off: stroking every marker outline is the bulk of Agg's
+    # per-frame cost for large particle counts.
+    x0, y0, z0, rho0 = X[0], Y[0], Z[0], RHO[0]
+    
+    # 3D scatter plot
+    sc_3d = ax_3d.scatter(x0, y0, z0, 
+                         c=rho0, s=10, cmap='hot', alpha=0.6, edgecolors='none',
+                         vmin=rho_range[0], vmax=rho_range[1])
+    ax_3d.set_xlabel('X')
+    ax_3d.set_ylabel('Y')
+    ax_3d.set_zlabel('Z')
+    ax_3d.set_xlim([-coord_max, coord_max])
+    ax_3d.set_ylim([-coord_max, coord_max])
+    ax_3d.set_zlim([-coord_max, coord_max])
+    
+    # XY projection
+    sc_xy = ax_xy.scatter(x0, y0, c=rho0, 
+                        s=15, cmap='hot', alpha=0.6, edgecolors='none',
+                        vmin=rho_range[0], vmax=rho_range[1])
+    ax_xy.set_xlabel('X')
+    ax_xy.set_ylabel('Y')
+    ax_xy.set_title('XY Projection', fontsize=10)
+    ax_xy.set_xlim([-coord_max, coord_max])
+    ax_xy.set_ylim([-coord_max, coord_max])
+    ax_xy.set_aspect('equal')
+    ax_xy.grid(True, alpha=0.3)
+    
+    # XZ projection
+    sc_xz = ax_xz.scatter(x0, z0, c=rho0, 
+                        s=15, cmap='hot', alpha=0.6, edgecolors='none',
+                        vmin=rho_range[0], vmax=rho_range[1])
+    ax_xz.set_xlabel('X')
+    ax_xz.set_ylabel('Z')
+    ax_xz.set_title('XZ Projection', fontsize=10)
+    ax_xz.set_xlim([-coord_max, coord_max])
+    ax_xz.set_ylim([-coord_max, coord_max])
+    ax_xz.set_aspect('equal')
+    ax_xz.grid(True, alpha=0.3)
+    
+    # YZ projection
+    sc_yz = ax_yz.scatter(y0, z0, c=rho0, 
+                        s=15, cmap='hot', alpha=0.6, edgecolors='none',
+                        vmin=rho_range[0], vmax=rho_range[1])
+    ax_yz.set_xlabel('Y')
+    ax_yz.set_ylabel('Z')
+    ax_yz.set_title('YZ Projection', fontsize=10)
+    ax_yz.set_xlim([-coord_max, coord_max])
+    ax_yz.set_ylim([-coord_max, coord_max])
+    ax_yz.set_aspect('equal')
+    ax_yz.grid(True, alpha=0.3)
+    
+    # Add colorbar to the last subplot
+    plt.colorbar(sc_yz, ax=ax_yz, label='Density', fraction=0.046, pad=0.04)
+    
+    # Main title
+    title = fig.suptitle(' ', fontsize=16, fontweight='bold')
+    
+    # Layout is solved once; the artists keep their positions afterwards
+    plt.tight_layout()
+    
     def update(frame):
         """Update function for animation."""
-        # Clear all axes
-        ax_3d.clear()
-        ax_xy.clear()
-        ax_xz.clear()
-        ax_yz.clear()
-        
-        data = snapshots[frame]
+        x, y, z, rho = X[frame], Y[frame], Z[frame], RHO[frame]
         time = times[frame]
         
-        # 3D scatter plot
-        sc_3d = ax_3d.scatter(data['x'], data['y'], data['z'], 
-                             c=data['rho'], s=10, cmap='hot', alpha=0.6,
-                             vmin=rho_range[0], vmax=rho_range[1])
-        ax_3d.set_xlabel('X')
-        ax_3d.set_ylabel('Y')
-        ax_3d.set_zlabel('Z')
+        sc_3d._offsets3d = (x, y, z)
+        sc_3d.set_array(rho)
         ax_3d.set_title(f'3D View (t = {time:.3f})', fontsize=12, fontweight='bold')
-        ax_3d.set_xlim([-coord_max, coord_max])
-        ax_3d.set_ylim([-coord_max, coord_max])
-        ax_3d.set_zlim([-coord_max, coord_max])
-        
-        # Rotate view for better visualization
-        ax_3d.view_init(elev=20, azim=45 + frame * 2)  # Slow rotation
-        
-        # XY projection
-        sc_xy = ax_xy.scatter(data['x'], data['y'], c=data['rho'], 
-                            s=15, cmap='hot', alpha=0.6,
-                            vmin=rho_range[0], vmax=rho_range[1])
-        ax_xy.set_xlabel('X')
-        ax_xy.set_ylabel('Y')
-        ax_xy.set_title('XY Projection', fontsize=10)
-        ax_xy.set_xlim([-coord_max, coord_max])
-        ax_xy.set_ylim([-coord_max, coord_max])
-        ax_xy.set_aspect('equal')
-        ax_xy.grid(True, alpha=0.3)
         
-        # XZ projection
-        sc_xz = ax_xz.scatter(data['x'], data['z'], c=data['rho'], 
-                            s=15, cmap='hot', alpha=0.6,
-                            vmin=rho_range[0], vmax=rho_range[1])
-        ax_xz.set_xlabel('X')
-        ax_xz.set_ylabel('Z')
-        ax_xz.set_title('XZ Projection', fontsize=10)
-        ax_xz.set_xlim([-coord_max, coord_max])
-        ax_xz.set_ylim([-coord_max, coord_max])
-        ax_xz.set_aspect('equal')
-        ax_xz.grid(True, alpha=0.3)
+        # Rotate view for better visualization. Changing the view makes
+        # mplot3d rebuild its projection, so only step the camera every
+        # ROTATION_STEP frames.
+        if frame % ROTATION_STEP == 0:
+            ax_3d.view_init(elev=20, azim=45 + frame * 2)  # Slow rotation
         
-        # YZ projection
-        sc_yz = ax_yz.scatter(data['y'], data['z'], c=data['rho'], 
-                            s=15, cmap='hot', alpha=0.6,
-                            vmin=rho_range[0], vmax=rho_range[1])
-        ax_yz.set_xlabel('Y')
-        ax_yz.set_ylabel('Z')
-        ax_yz.set_title('YZ Projection', fontsize=10)
-        ax_yz.set_xlim([-coord_max, coord_max])
-        ax_yz.set_ylim([-coord_max, coord_max])
-        ax_yz.set_aspect('equal')
-        ax_yz.grid(True, alpha=0.3)
+        sc_xy.set_offsets(np.column_stack((x, y)))
+        sc_xz.set_offsets(np.column_stack((x, z)))
+        sc_yz.set_offsets(np.column_stack((y, z)))
+        for sc in (sc_xy, sc_xz, sc_yz):
+            sc.set_array(rho)
         
-        # Add colorbar to the last subplot
-        if frame == 0:
-            plt.colorbar(sc_yz, ax=ax_yz, label='Density', fraction=0.046, pad=0.04)
-        
-        # Main title
-        fig.suptitle(f'Evrard Collapse - Frame {frame+1}/{len(snapshots)} - Time: {time:.3f}', 
-                    fontsize=16, fontweight='bold')
-        
-        plt.tight_layout()
+        title.set_text(f'Evrard Collapse - Frame {frame+1}/{n_frames} - Time: {time:.3f}')
+        return sc_3d, sc_xy, sc_xz, sc_yz, title
     
-    # Create animation
+    # Render frames straight into an ffmpeg rawvideo pipe
     print("Creating 3D animation...")
-    anim = FuncAnimation(fig, update, frames=len(snapshots), 
-                        interval=200, repeat=True)
-    
-    # Save animation
     print(f"Saving animation to {OUTPUT_FILE}...")
     try:
-        writer = FFMpegWriter(fps=5, bitrate=2400, codec='libx264')
-        anim.save(OUTPUT_FILE, writer=writer, dpi=100)
+        write_animation(fig, update, n_frames, OUTPUT_FILE,
+                        fps=5, bitrate=2400, codec='libx264', dpi=100)
         print(f"✓ Animation saved: {OUTPUT_FILE}")
     except Exception as e:
         print(f"Error saving animation: {e}")
@@ -213,9 +260,9 @@ def main():
     
     # Print statistics
     print("\n=== Animation Statistics ===")
-    print(f"Total frames: {len(snapshots)}")
+    print(f"Total frames: {n_frames}")
     print(f"Time range: [{times[0]:.3f}, {times[-1]:.3f}]")
-    print(f"Particles per frame: {len(snapshots[0]['x'])}")
+    print(f"Particles per frame: {n_particles}")
     print(f"Output file: {OUTPUT_FILE}")
     print("===========================\n")
 
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Binary cache for Evrard CSV snapshots.
+
+The first read of a snapshot parses the CSV and stores it next to the
+original as a structured .npy array (one field per CSV column). Later
+reads memory-map the .npy instead of re-parsing the text, as long as the
+cache is not older than the CSV.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def cache_path_for(filepath):
+    """Return the .npy cache path for a snapshot CSV."""
+    return str(filepath) + '.npy'
+
+
+def load_snapshot_table(filepath):
+    """Load a snapshot CSV as a structured array with one field per column.
+
+    Fields are accessed by CSV column name, e.g. table['pos_x'].
+    """
+    filepath = str(filepath)
+    cache_path = cache_path_for(filepath)
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(filepath):
+            return np.load(cache_path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass  # No usable cache: parse the CSV and rewrite it
+
+    df = pd.read_csv(filepath, comment='#', dtype=np.float64, engine='c')
+    table = df.to_records(index=False).view(np.ndarray)
+
+    # Write to a per-process temporary name first so a concurrent reader or
+    # writer never sees a half-written cache
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, table)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: could not write snapshot cache {cache_path}: {e}")
+    return table
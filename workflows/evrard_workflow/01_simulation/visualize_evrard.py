@@ -5,12 +5,19 @@ Reproduces energy profile plots as shown in Evrard (1988) and other SPH papers
 """
 
 import numpy as np
+import pandas as pd
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
 from pathlib import Path
 import sys
 
+ENERGY_COLUMNS = ['time', 'kinetic', 'thermal', 'potential', 'total']
+
+# Light zlib compression for the saved PNGs: faster to encode, slightly
+# larger files
+PNG_OPTIONS = {'compress_level': 1}
+
 class EvrardEnergyAnalyzer:
     """Analyzes and visualizes energy conservation in Evrard collapse simulation"""
     
@@ -21,20 +28,34 @@ class EvrardEnergyAnalyzer:
         
         if not self.energy_file.exists():
             raise FileNotFoundError(f"Energy file not found: {self.energy_file}")
+        
+        # Parsed energy data and the file mtime it was read at
+        self._energy = None
+        self._energy_mtime = None
     
     def load_energy_data(self):
-        """Load energy data from energy.csv file"""
+        """Load energy data from energy.csv file
+        
+        The parsed arrays are cached and shared between callers (read-only);
+        the file is re-read only when its modification time changes.
+        """
+        mtime = self.energy_file.stat().st_mtime
+        if self._energy is not None and mtime == self._energy_mtime:
+            return self._energy
+        
         # CSV format: time,kinetic,thermal,potential,total
-        # Skip comment lines starting with #
-        data = np.loadtxt(self.energy_file, delimiter=',', comments='#', skiprows=1)
-        
-        return {
-            'time': data[:, 0],
-            'kinetic': data[:, 1],
-            'thermal': data[:, 2],
-            'potential': data[:, 3],
-            'total': data[:, 4]
-        }
+        # Skip comment lines starting with #; the first other line is the header
+        df = pd.read_csv(self.energy_file, comment='#', header=0,
+                         names=ENERGY_COLUMNS, dtype=np.float64, engine='c')
+        
+        energy = {}
+        for name in ENERGY_COLUMNS:
+            energy[name] = df[name].to_numpy()
+            energy[name].setflags(write=False)
+        
+        self._energy = energy
+        self._energy_mtime = mtime
+        return energy
     
     def plot_energy_evolution(self, save_path='energy_evolution.png'):
         """
@@ -61,7 +82,8 @@ class EvrardEnergyAnalyzer:
         
         # Bottom panel: Energy conservation error
         E_initial = energy['total'][0]
-        energy_error = (energy['total'] - E_initial) / np.abs(E_initial) * 100
+        energy_error = energy['total'] - E_initial
+        energy_error *= 100 / np.abs(E_initial)
         
         ax2.plot(energy['time'], energy_error, 'r-', linewidth=2)
         ax2.axhline(y=0, color='k', linestyle='-', linewidth=1)
@@ -84,7 +106,8 @@ class EvrardEnergyAnalyzer:
                 bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5))
         
         plt.tight_layout()
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        plt.savefig(save_path, dpi=120, bbox_inches='tight',
+                    pil_kwargs=PNG_OPTIONS)
         print(f"✓ Energy evolution plot saved: {save_path}")
         plt.close()
         
@@ -128,7 +151,8 @@ class EvrardEnergyAnalyzer:
             ax.axvspan(0, 0.8, alpha=0.1, color='blue', label='Collapse Phase')
         
         plt.tight_layout()
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        plt.savefig(save_path, dpi=150, bbox_inches='tight',
+                    pil_kwargs=PNG_OPTIONS)
         print(f"✓ Paper-style energy plot saved: {save_path}")
         plt.close()
     
@@ -139,11 +163,11 @@ class EvrardEnergyAnalyzer:
         """
         energy = self.load_energy_data()
         
-        # Calculate fractions
-        E_total_abs = np.abs(energy['total'])
-        kinetic_frac = energy['kinetic'] / E_total_abs
-        thermal_frac = energy['thermal'] / E_total_abs
-        potential_frac = energy['potential'] / E_total_abs
+        # Calculate fractions: stack the components into one (3, T) array
+        # and divide it in place by |E_total| in a single broadcast
+        fractions = np.stack((energy['kinetic'], energy['thermal'], energy['potential']))
+        np.divide(fractions, np.abs(energy['total']), out=fractions)
+        kinetic_frac, thermal_frac, potential_frac = fractions
         
         fig, ax = plt.subplots(figsize=(12, 8))
         
@@ -160,7 +184,8 @@ class EvrardEnergyAnalyzer:
         ax.tick_params(labelsize=14)
         
         plt.tight_layout()
-        plt.savefig(save_path, dpi=150, bbox_inches='tight')
+        plt.savefig(save_path, dpi=120, bbox_inches='tight',
+                    pil_kwargs=PNG_OPTIONS)
         print(f"✓ Normalized energy components plot saved: {save_path}")
         plt.close()
     
@@ -196,10 +221,13 @@ class EvrardEnergyAnalyzer:
         print(f"  ΔE_potential: {energy['potential'][-1] - energy['potential'][0]:>12.6e}")
         
         # Energy conservation metrics
-        energy_error = (energy['total'] - E_initial) / np.abs(E_initial) * 100
-        max_error = np.max(np.abs(energy_error))
-        mean_error = np.mean(np.abs(energy_error))
+        energy_error = energy['total'] - E_initial
+        energy_error *= 100 / np.abs(E_initial)
         final_error = energy_error[-1]
+        # Both metrics use |error|; take it once, in place
+        abs_error = np.abs(energy_error, out=energy_error)
+        max_error = abs_error.max()
+        mean_error = abs_error.mean()
         
         print(f"\nEnergy Conservation Metrics:")
         print(f"  Maximum |ΔE/E₀|: {max_error:.4f}%")
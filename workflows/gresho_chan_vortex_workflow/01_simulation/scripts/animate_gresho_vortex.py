@@ -5,68 +5,29 @@ Generates visualization of the vortex evolution.
 """
 
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Non-interactive backend
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation, FFMpegWriter
-import glob
 import os
 import sys
 
+# Shared snapshot loading, field binning and video writer live in
+# workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'common'))
+from sph_io import find_snapshots, load_frames, load_frame_cache, save_frame_cache
+from ffmpeg_pipe import write_animation
+from field_grid import SCATTER_MAX_POINTS, FIELD_GRID, grid_cells, grid_mean
+
 # Configuration
 RESULTS_DIR = "../results"
 ANIMATIONS_DIR = "../results/analysis/animations"
 OUTPUT_FILE = os.path.join(ANIMATIONS_DIR, "gresho_vortex.mp4")
 
-def load_snapshot(filename):
-    """Load a single snapshot CSV file."""
-    try:
-        # Count header lines to skip and detect format
-        skip_lines = 0
-        has_id_column = False
-        with open(filename) as f:
-            for line in f:
-                if line.startswith('#'):
-                    skip_lines += 1
-                else:
-                    # First non-comment line is the header
-                    skip_lines += 1
-                    has_id_column = line.startswith('id,')
-                    break
-        
-        data = np.loadtxt(filename, delimiter=',', skiprows=skip_lines)
-        if data.size == 0:
-            return None
-        if data.ndim == 1:
-            data = data.reshape(1, -1)
-        
-        if has_id_column:
-            # New format: id,pos_x,pos_y,vel_x,vel_y,acc_x,acc_y,mass,density,pressure,energy,smoothing_length,sound_speed,neighbors
-            return {
-                'x': data[:, 1],   # pos_x
-                'y': data[:, 2],   # pos_y
-                'vx': data[:, 3],  # vel_x
-                'vy': data[:, 4],  # vel_y
-                'rho': data[:, 8], # density
-                'P': data[:, 9],   # pressure
-                'h': data[:, 11],  # smoothing_length
-                'm': data[:, 7],   # mass
-                'u': data[:, 10]   # energy
-            }
-        else:
-            # Old format: pos_x,pos_y,vel_x,vel_y,acc_x,acc_y,mass,density,pressure,energy,sound_speed,smoothing_length,...
-            return {
-                'x': data[:, 0],   # pos_x
-                'y': data[:, 1],   # pos_y
-                'vx': data[:, 2],  # vel_x
-                'vy': data[:, 3],  # vel_y
-                'rho': data[:, 7], # density
-                'P': data[:, 8],   # pressure
-                'h': data[:, 11],  # smoothing_length
-                'm': data[:, 6],   # mass
-                'u': data[:, 9]    # energy
-            }
-    except Exception as e:
-        print(f"Error loading {filename}: {e}")
-        return None
+# Parsed frames are cached here, one .npy per field, and reused while no
+# snapshot is newer
+FRAME_CACHE = os.path.join(RESULTS_DIR, "snapshot_frames")
+FRAME_FIELDS = ('x', 'y', 'vx', 'vy', 'rho', 'P')
 
 def main():
     """Generate animation for Gresho-Chan vortex."""
@@ -75,7 +36,7 @@ def main():
     os.makedirs(ANIMATIONS_DIR, exist_ok=True)
     
     # Find snapshot files
-    snapshot_files = sorted(glob.glob(os.path.join(RESULTS_DIR, "snapshot_*.csv")))
+    snapshot_files = find_snapshots(RESULTS_DIR, "snapshot_")
     
     if not snapshot_files:
         print(f"Error: No snapshot files found in {RESULTS_DIR}")
@@ -84,114 +45,112 @@ def main():
     
     print(f"Found {len(snapshot_files)} snapshots")
     
-    # Load all snapshots
-    snapshots = []
-    times = []
-    for i, filename in enumerate(snapshot_files):
-        data = load_snapshot(filename)
-        if data is not None:
-            snapshots.append(data)
-            # Extract time from filename or use index
-            times.append(i * 0.02)  # Adjust based on actual output frequency
-    
-    if not snapshots:
-        print("Error: Failed to load any snapshots")
-        sys.exit(1)
+    # Reuse the parsed frames from the last run unless a snapshot changed
+    frames = load_frame_cache(FRAME_CACHE, snapshot_files, FRAME_FIELDS)
+    if frames is not None:
+        print(f"Using cached frames: {FRAME_CACHE}")
+    else:
+        frames = load_frames(snapshot_files, FRAME_FIELDS)
+        if frames is None:
+            print("Error: Failed to load any snapshots")
+            sys.exit(1)
+        save_frame_cache(FRAME_CACHE, snapshot_files, frames)
     
-    print(f"Loaded {len(snapshots)} valid snapshots")
+    keep, counts = frames['keep'], frames['counts']
+    X, Y, VX, VY, RHO, P = (frames[name] for name in FRAME_FIELDS)
+    n_frames = len(keep)
+    # Extract time from filename or use index
+    times = [i * 0.02 for i in keep]  # Adjust based on actual output frequency
+    
+    # Velocity magnitude for every frame, computed once up front
+    V_MAG = np.hypot(VX, VY)
+    
+    print(f"Loaded {n_frames} valid snapshots")
     
     # Set up the figure
     fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(14, 12))
     
-    # Find global min/max for consistent scaling
-    all_x = np.concatenate([s['x'] for s in snapshots])
-    all_y = np.concatenate([s['y'] for s in snapshots])
-    all_rho = np.concatenate([s['rho'] for s in snapshots])
-    all_P = np.concatenate([s['P'] for s in snapshots])
-    all_vx = np.concatenate([s['vx'] for s in snapshots])
-    all_vy = np.concatenate([s['vy'] for s in snapshots])
-    all_v_mag = np.sqrt(all_vx**2 + all_vy**2)
-    
-    x_range = [all_x.min() * 1.1, all_x.max() * 1.1]
-    y_range = [all_y.min() * 1.1, all_y.max() * 1.1]
-    rho_range = [all_rho.min(), all_rho.max()]
-    P_range = [all_P.min(), all_P.max()]
-    v_range = [0, all_v_mag.max()]
+    # Find global min/max for consistent scaling (NaN padding is ignored)
+    x_range = [np.nanmin(X) * 1.1, np.nanmax(X) * 1.1]
+    y_range = [np.nanmin(Y) * 1.1, np.nanmax(Y) * 1.1]
+    rho_range = [np.nanmin(RHO), np.nanmax(RHO)]
+    P_range = [np.nanmin(P), np.nanmax(P)]
+    v_range = [0, np.nanmax(V_MAG)]
+    
+    # Large runs draw the field panels as binned images (see FIELD_GRID)
+    use_grid = counts.max() > SCATTER_MAX_POINTS
+    extent = (*x_range, *y_range)
+    
+    def field_panel(ax, cmap, value_range):
+        if use_grid:
+            return ax.imshow(np.full((FIELD_GRID, FIELD_GRID), np.nan),
+                             extent=extent, origin='lower', cmap=cmap,
+                             vmin=value_range[0], vmax=value_range[1],
+                             interpolation='nearest')
+        return ax.scatter([], [], c=[], s=10, cmap=cmap, alpha=0.7,
+                          vmin=value_range[0], vmax=value_range[1])
+    
+    # Build the artists once; update() only swaps in each frame's data
+    sc1 = field_panel(ax1, 'viridis', rho_range)
+    sc2 = field_panel(ax2, 'plasma', P_range)
+    sc3 = field_panel(ax3, 'coolwarm', v_range)
+    plt.colorbar(sc1, ax=ax1, label='Density')
+    plt.colorbar(sc2, ax=ax2, label='Pressure')
+    plt.colorbar(sc3, ax=ax3, label='|v|')
+    
+    # Subsample the velocity field for clarity. A quiver keeps a fixed
+    # number of arrows, so take the same columns of the NaN-padded rows in
+    # every frame (padded entries are masked and not drawn). The arrow
+    # data of all frames is gathered here once; update() takes row views
+    quiver_idx = np.arange(0, X.shape[1], max(1, X.shape[1] // 1000))
+    QX, QY, QVX, QVY = (values[:, quiver_idx] for values in (X, Y, VX, VY))
+    Q_MAG = V_MAG[:, quiver_idx]
+    quiv = ax4.quiver(QX[0], QY[0], QVX[0], QVY[0], Q_MAG[0],
+                      cmap='coolwarm', alpha=0.7)
+    quiv.set_clim(v_range)
+    
+    for ax in (ax1, ax2, ax3, ax4):
+        ax.set_xlabel('x')
+        ax.set_ylabel('y')
+        ax.set_xlim(x_range)
+        ax.set_ylim(y_range)
+        ax.set_aspect('equal')
+    suptitle = fig.suptitle('', fontsize=14, fontweight='bold')
     
     def update(frame):
         """Update function for animation."""
-        ax1.clear()
-        ax2.clear()
-        ax3.clear()
-        ax4.clear()
-        
-        data = snapshots[frame]
+        n = counts[frame]
         time = times[frame]
         
-        # Calculate velocity magnitude
-        v_mag = np.sqrt(data['vx']**2 + data['vy']**2)
-        
-        # Plot density
-        sc1 = ax1.scatter(data['x'], data['y'], c=data['rho'], 
-                         s=10, cmap='viridis', alpha=0.7,
-                         vmin=rho_range[0], vmax=rho_range[1])
-        ax1.set_xlabel('x')
-        ax1.set_ylabel('y')
+        # Density, pressure and velocity magnitude
+        fields = ((sc1, RHO[frame, :n]), (sc2, P[frame, :n]), (sc3, V_MAG[frame, :n]))
+        x, y = X[frame, :n], Y[frame, :n]
+        if use_grid:
+            cells = grid_cells(x, y, extent)
+            for artist, values in fields:
+                artist.set_data(grid_mean(cells, values))
+        else:
+            offsets = np.column_stack((x, y))
+            for artist, values in fields:
+                artist.set_offsets(offsets)
+                artist.set_array(values)
         ax1.set_title(f'Density (t = {time:.3f})')
-        ax1.set_xlim(x_range)
-        ax1.set_ylim(y_range)
-        ax1.set_aspect('equal')
-        plt.colorbar(sc1, ax=ax1, label='Density')
-        
-        # Plot pressure
-        sc2 = ax2.scatter(data['x'], data['y'], c=data['P'], 
-                         s=10, cmap='plasma', alpha=0.7,
-                         vmin=P_range[0], vmax=P_range[1])
-        ax2.set_xlabel('x')
-        ax2.set_ylabel('y')
         ax2.set_title(f'Pressure (t = {time:.3f})')
-        ax2.set_xlim(x_range)
-        ax2.set_ylim(y_range)
-        ax2.set_aspect('equal')
-        plt.colorbar(sc2, ax=ax2, label='Pressure')
-        
-        # Plot velocity magnitude
-        sc3 = ax3.scatter(data['x'], data['y'], c=v_mag, 
-                         s=10, cmap='coolwarm', alpha=0.7,
-                         vmin=v_range[0], vmax=v_range[1])
-        ax3.set_xlabel('x')
-        ax3.set_ylabel('y')
         ax3.set_title(f'Velocity Magnitude (t = {time:.3f})')
-        ax3.set_xlim(x_range)
-        ax3.set_ylim(y_range)
-        ax3.set_aspect('equal')
-        plt.colorbar(sc3, ax=ax3, label='|v|')
         
-        # Plot velocity field (quiver)
-        # Subsample for clarity
-        skip = max(1, len(data['x']) // 1000)
-        ax4.quiver(data['x'][::skip], data['y'][::skip], 
-                  data['vx'][::skip], data['vy'][::skip],
-                  v_mag[::skip], cmap='coolwarm', alpha=0.7)
-        ax4.set_xlabel('x')
-        ax4.set_ylabel('y')
+        # Velocity field (quiver)
+        quiv.set_offsets(np.column_stack((QX[frame], QY[frame])))
+        quiv.set_UVC(QVX[frame], QVY[frame], Q_MAG[frame])
         ax4.set_title(f'Velocity Field (t = {time:.3f})')
-        ax4.set_xlim(x_range)
-        ax4.set_ylim(y_range)
-        ax4.set_aspect('equal')
         
-        fig.suptitle(f'Gresho-Chan Vortex - Frame {frame+1}/{len(snapshots)}', 
-                    fontsize=14, fontweight='bold')
-    
-    # Create animation
-    print("Creating animation...")
-    anim = FuncAnimation(fig, update, frames=len(snapshots), 
-                        interval=100, repeat=True)
+        suptitle.set_text(f'Gresho-Chan Vortex - Frame {frame+1}/{n_frames}')
+        return sc1, sc2, sc3, quiv
     
-    # Save animation
+    # Render frames straight into an ffmpeg rawvideo pipe, with a fast
+    # x264 preset
     print(f"Saving animation to {OUTPUT_FILE}...")
-    writer = FFMpegWriter(fps=10, bitrate=1800)
-    anim.save(OUTPUT_FILE, writer=writer, dpi=100)
+    write_animation(fig, update, n_frames, OUTPUT_FILE, fps=10, bitrate=1800,
+                    dpi=100, extra_args=['-preset', 'veryfast'])
     
     print(f"✓ Animation saved: {OUTPUT_FILE}")
     plt.close()
@@ -5,68 +5,29 @@ Generates visualization of the pressure and density profiles.
 """
 
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Non-interactive backend
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation, FFMpegWriter
-import glob
 import os
 import sys
 
+# Shared snapshot loading, field binning and video writer live in
+# workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'common'))
+from sph_io import find_snapshots, load_frames, load_frame_cache, save_frame_cache
+from ffmpeg_pipe import write_animation
+from field_grid import SCATTER_MAX_POINTS, FIELD_GRID, grid_cells, grid_mean
+
 # Configuration
 RESULTS_DIR = "../results"
 ANIMATIONS_DIR = "../results/analysis/animations"
 OUTPUT_FILE = os.path.join(ANIMATIONS_DIR, "hydrostatic.mp4")
 
-def load_snapshot(filename):
-    """Load a single snapshot CSV file."""
-    try:
-        # Count header lines to skip and detect format
-        skip_lines = 0
-        has_id_column = False
-        with open(filename) as f:
-            for line in f:
-                if line.startswith('#'):
-                    skip_lines += 1
-                else:
-                    # First non-comment line is the header
-                    skip_lines += 1
-                    has_id_column = line.startswith('id,')
-                    break
-        
-        data = np.loadtxt(filename, delimiter=',', skiprows=skip_lines)
-        if data.size == 0:
-            return None
-        if data.ndim == 1:
-            data = data.reshape(1, -1)
-        
-        if has_id_column:
-            # New format: id,pos_x,pos_y,vel_x,vel_y,acc_x,acc_y,mass,density,pressure,energy,smoothing_length,sound_speed,neighbors
-            return {
-                'x': data[:, 1],   # pos_x
-                'y': data[:, 2],   # pos_y
-                'vx': data[:, 3],  # vel_x
-                'vy': data[:, 4],  # vel_y
-                'rho': data[:, 8], # density
-                'P': data[:, 9],   # pressure
-                'h': data[:, 11],  # smoothing_length
-                'm': data[:, 7],   # mass
-                'u': data[:, 10]   # energy
-            }
-        else:
-            # Old format: pos_x,pos_y,vel_x,vel_y,acc_x,acc_y,mass,density,pressure,energy,sound_speed,smoothing_length,...
-            return {
-                'x': data[:, 0],   # pos_x
-                'y': data[:, 1],   # pos_y
-                'vx': data[:, 2],  # vel_x
-                'vy': data[:, 3],  # vel_y
-                'rho': data[:, 7], # density
-                'P': data[:, 8],   # pressure
-                'h': data[:, 11],  # smoothing_length
-                'm': data[:, 6],   # mass
-                'u': data[:, 9]    # energy
-            }
-    except Exception as e:
-        print(f"Error loading {filename}: {e}")
-        return None
+# Parsed frames are cached here, one .npy per field, and reused while no
+# snapshot is newer
+FRAME_CACHE = os.path.join(RESULTS_DIR, "snapshot_frames")
+FRAME_FIELDS = ('x', 'y', 'rho', 'P')
 
 def main():
     """Generate animation for hydrostatic equilibrium."""
@@ -75,7 +36,7 @@ def main():
     os.makedirs(ANIMATIONS_DIR, exist_ok=True)
     
     # Find snapshot files
-    snapshot_files = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.csv")))
+    snapshot_files = find_snapshots(RESULTS_DIR)
     
     if not snapshot_files:
         print(f"Error: No snapshot files found in {RESULTS_DIR}")
@@ -84,97 +45,113 @@ def main():
     
     print(f"Found {len(snapshot_files)} snapshots")
     
-    # Load all snapshots
-    snapshots = []
-    times = []
-    for i, filename in enumerate(snapshot_files):
-        data = load_snapshot(filename)
-        if data is not None:
-            snapshots.append(data)
-            # Extract time from filename or use index
-            times.append(i * 0.02)  # Adjust based on actual output frequency
-    
-    if not snapshots:
-        print("Error: Failed to load any snapshots")
-        sys.exit(1)
+    # Reuse the parsed frames from the last run unless a snapshot changed
+    frames = load_frame_cache(FRAME_CACHE, snapshot_files, FRAME_FIELDS)
+    if frames is not None:
+        print(f"Using cached frames: {FRAME_CACHE}")
+    else:
+        frames = load_frames(snapshot_files, FRAME_FIELDS)
+        if frames is None:
+            print("Error: Failed to load any snapshots")
+            sys.exit(1)
+        save_frame_cache(FRAME_CACHE, snapshot_files, frames)
+    
+    keep, counts = frames['keep'], frames['counts']
+    X, Y, RHO, P = (frames[name] for name in FRAME_FIELDS)
+    # Order each frame's particles by height once, so the vertical profiles
+    # are drawn straight from the frame slices (NaN padding sorts last)
+    order = np.argsort(Y, axis=1)
+    X, Y, RHO, P = (np.take_along_axis(values, order, axis=1)
+                    for values in (X, Y, RHO, P))
+    n_frames = len(keep)
+    # Extract time from filename or use index
+    times = [i * 0.02 for i in keep]  # Adjust based on actual output frequency
     
-    print(f"Loaded {len(snapshots)} valid snapshots")
+    print(f"Loaded {n_frames} valid snapshots")
     
     # Set up the figure
     fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(14, 12))
     
-    # Find global min/max for consistent scaling
-    all_x = np.concatenate([s['x'] for s in snapshots])
-    all_y = np.concatenate([s['y'] for s in snapshots])
-    all_rho = np.concatenate([s['rho'] for s in snapshots])
-    all_P = np.concatenate([s['P'] for s in snapshots])
+    # Find global min/max for consistent scaling (NaN padding is ignored)
+    x_range = [np.nanmin(X) * 1.1, np.nanmax(X) * 1.1]
+    y_range = [np.nanmin(Y) * 1.1, np.nanmax(Y) * 1.1]
+    rho_range = [np.nanmin(RHO), np.nanmax(RHO)]
+    P_range = [np.nanmin(P), np.nanmax(P)]
+    
+    # Large runs draw the field panels as binned images (see FIELD_GRID)
+    use_grid = counts.max() > SCATTER_MAX_POINTS
+    extent = (*x_range, *y_range)
     
-    x_range = [all_x.min() * 1.1, all_x.max() * 1.1]
-    y_range = [all_y.min() * 1.1, all_y.max() * 1.1]
-    rho_range = [all_rho.min(), all_rho.max()]
-    P_range = [all_P.min(), all_P.max()]
+    def field_panel(ax, cmap, value_range):
+        if use_grid:
+            return ax.imshow(np.full((FIELD_GRID, FIELD_GRID), np.nan),
+                             extent=extent, origin='lower', cmap=cmap,
+                             vmin=value_range[0], vmax=value_range[1],
+                             interpolation='nearest')
+        return ax.scatter([], [], c=[], s=10, cmap=cmap, alpha=0.7,
+                          vmin=value_range[0], vmax=value_range[1])
+    
+    # Build the artists once; update() only swaps in each frame's data
+    sc1 = field_panel(ax1, 'viridis', rho_range)
+    sc2 = field_panel(ax2, 'plasma', P_range)
+    plt.colorbar(sc1, ax=ax1, label='Density')
+    plt.colorbar(sc2, ax=ax2, label='Pressure')
+    for ax in (ax1, ax2):
+        ax.set_xlabel('x')
+        ax.set_ylabel('y')
+        ax.set_xlim(x_range)
+        ax.set_ylim(y_range)
+        ax.set_aspect('equal')
+    
+    # Vertical profiles, on fixed axes so frames are comparable
+    line_rho, = ax3.plot([], [], 'b-', alpha=0.5)
+    ax3.set_xlabel('Height (y)')
+    ax3.set_ylabel('Density')
+    line_P, = ax4.plot([], [], 'r-', alpha=0.5)
+    ax4.set_xlabel('Height (y)')
+    ax4.set_ylabel('Pressure')
+    for ax, value_range in ((ax3, rho_range), (ax4, P_range)):
+        ax.update_datalim([(np.nanmin(Y), value_range[0]),
+                           (np.nanmax(Y), value_range[1])])
+        ax.autoscale_view()
+        ax.set_autoscale_on(False)
+        ax.grid(True, alpha=0.3)
+    suptitle = fig.suptitle('', fontsize=14, fontweight='bold')
     
     def update(frame):
         """Update function for animation."""
-        ax1.clear()
-        ax2.clear()
-        ax3.clear()
-        ax4.clear()
-        
-        data = snapshots[frame]
+        n = counts[frame]
+        x, y, rho, pres = X[frame, :n], Y[frame, :n], RHO[frame, :n], P[frame, :n]
         time = times[frame]
         
-        # Plot density field
-        sc1 = ax1.scatter(data['x'], data['y'], c=data['rho'], 
-                         s=10, cmap='viridis', alpha=0.7,
-                         vmin=rho_range[0], vmax=rho_range[1])
-        ax1.set_xlabel('x')
-        ax1.set_ylabel('y')
+        # Density and pressure fields
+        fields = ((sc1, rho), (sc2, pres))
+        if use_grid:
+            cells = grid_cells(x, y, extent)
+            for artist, values in fields:
+                artist.set_data(grid_mean(cells, values))
+        else:
+            offsets = np.column_stack((x, y))
+            for artist, values in fields:
+                artist.set_offsets(offsets)
+                artist.set_array(values)
         ax1.set_title(f'Density (t = {time:.3f})')
-        ax1.set_xlim(x_range)
-        ax1.set_ylim(y_range)
-        ax1.set_aspect('equal')
-        plt.colorbar(sc1, ax=ax1, label='Density')
-        
-        # Plot pressure field
-        sc2 = ax2.scatter(data['x'], data['y'], c=data['P'], 
-                         s=10, cmap='plasma', alpha=0.7,
-                         vmin=P_range[0], vmax=P_range[1])
-        ax2.set_xlabel('x')
-        ax2.set_ylabel('y')
         ax2.set_title(f'Pressure (t = {time:.3f})')
-        ax2.set_xlim(x_range)
-        ax2.set_ylim(y_range)
-        ax2.set_aspect('equal')
-        plt.colorbar(sc2, ax=ax2, label='Pressure')
         
-        # Plot density vs height (vertical profile)
-        y_sorted_idx = np.argsort(data['y'])
-        ax3.plot(data['y'][y_sorted_idx], data['rho'][y_sorted_idx], 'b-', alpha=0.5)
-        ax3.set_xlabel('Height (y)')
-        ax3.set_ylabel('Density')
+        # Density and pressure vs height (vertical profiles)
+        line_rho.set_data(y, rho)
         ax3.set_title(f'Density Profile (t = {time:.3f})')
-        ax3.grid(True, alpha=0.3)
-        
-        # Plot pressure vs height (vertical profile)
-        ax4.plot(data['y'][y_sorted_idx], data['P'][y_sorted_idx], 'r-', alpha=0.5)
-        ax4.set_xlabel('Height (y)')
-        ax4.set_ylabel('Pressure')
+        line_P.set_data(y, pres)
         ax4.set_title(f'Pressure Profile (t = {time:.3f})')
-        ax4.grid(True, alpha=0.3)
         
-        fig.suptitle(f'Hydrostatic Equilibrium - Frame {frame+1}/{len(snapshots)}', 
-                    fontsize=14, fontweight='bold')
-    
-    # Create animation
-    print("Creating animation...")
-    anim = FuncAnimation(fig, update, frames=len(snapshots), 
-                        interval=100, repeat=True)
+        suptitle.set_text(f'Hydrostatic Equilibrium - Frame {frame+1}/{n_frames}')
+        return sc1, sc2, line_rho, line_P
     
-    # Save animation
+    # Render frames straight into an ffmpeg rawvideo pipe, with a fast
+    # x264 preset
     print(f"Saving animation to {OUTPUT_FILE}...")
-    writer = FFMpegWriter(fps=10, bitrate=1800)
-    anim.save(OUTPUT_FILE, writer=writer, dpi=100)
+    write_animation(fig, update, n_frames, OUTPUT_FILE, fps=10, bitrate=1800,
+                    dpi=100, extra_args=['-preset', 'veryfast'])
     
     print(f"✓ Animation saved: {OUTPUT_FILE}")
     plt.close()
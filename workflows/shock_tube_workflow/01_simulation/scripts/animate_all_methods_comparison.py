@@ -5,45 +5,42 @@ Compares: baseline, modern, gsph, disph, ssph vs analytical solution
 """
 
 import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Non-interactive backend
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 from pathlib import Path
-from shock_tube_animation_utils import SodShockTube, load_sph_data
+from shock_tube_animation_utils import ANALYTIC_POINTS, SodShockTube, load_sph_data
 
+# Shared video writer lives in workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'common'))
+from ffmpeg_pipe import write_frames
 
-def create_multi_method_animation(result_dirs, output_file, gamma=1.4):
-    """Create animated comparison with all SPH methods overlapped
+# Frames are rendered by a pool of worker processes and handed to ffmpeg
+# in order. Each worker takes this many frames per batch, which bounds the
+# rendered frames waiting to be encoded
+RENDER_BATCH = 4
+
+
+def build_figure(method_offsets, times, analytic, x_analytic):
+    """Build the comparison figure for the preloaded frames
     
     Args:
-        result_dirs: Dict mapping method names to result directories
-        output_file: Output animation filename
-        gamma: Adiabatic index (default 1.4)
-    """
-    # Filter out methods that don't have data
-    available_methods = {}
-    for method, dir_path in result_dirs.items():
-        sph_files = sorted([f for f in Path(dir_path).glob("*.dat") if f.name != 'energy.dat'])
-        if len(sph_files) > 0:
-            available_methods[method] = sph_files
-        else:
-            print(f"⚠ No data found for {method} in {dir_path} (skipping)")
+        method_offsets: Dict mapping method names to per-frame scatter
+            offsets, each of shape (4, n_particles, 2): x against density,
+            velocity, pressure and energy
+        times: Time of each frame
+        analytic: Per-frame analytical density, velocity, pressure and energy
+        x_analytic: Positions of the analytical solution
     
-    if len(available_methods) == 0:
-        print("Error: No data files found for any method")
-        return
-    
-    # Use the first available method to determine frame count and domain
-    first_method = list(available_methods.keys())[0]
-    n_frames = len(available_methods[first_method])
-    print(f"Creating multi-method comparison animation with {n_frames} frames")
-    print(f"Methods: {', '.join(available_methods.keys())}")
-    
-    # Get domain from first method's first file
-    _, x_sample, _, _, _, _ = load_sph_data(available_methods[first_method][0])
-    x_min, x_max = x_sample.min(), x_sample.max()
-    x_analytic = np.linspace(x_min, x_max, 1000)
-    solver = SodShockTube(gamma=gamma)
+    Returns:
+        fig, animate: animate(frame) updates fig in place
+    """
+    x_min, x_max = x_analytic[0], x_analytic[-1]
     
     # Color scheme for methods
     colors = {
@@ -63,28 +60,28 @@ def create_multi_method_animation(result_dirs, output_file, gamma=1.4):
     }
     
     # Create figure with 2x2 subplots
-    fig, axes = plt.subplots(2, 2, figsize=(16, 12))
-    fig.suptitle('Shock Tube: All Methods Comparison vs Analytical', 
+    fig, axes = plt.subplots(2, 2, figsize=(16, 12), dpi=100)
+    fig.suptitle('Shock Tube: All Methods Comparison vs Analytical',
                  fontsize=16, fontweight='bold')
     
     # Analytical solution line
     line_analytic = []
     # SPH method scatters
-    scatters_methods = {method: [] for method in available_methods}
+    scatters_methods = {method: [] for method in method_offsets}
     
     titles = ['Density', 'Velocity', 'Pressure', 'Energy']
     ylabels = ['ρ', 'v', 'P', 'e']
     
     for i, ax in enumerate(axes.flat):
         # Analytical line (black, thick)
-        line, = ax.plot([], [], 'k-', linewidth=2.5, label='Analytical', 
+        line, = ax.plot([], [], 'k-', linewidth=2.5, label='Analytical',
                        alpha=0.9, zorder=10)
         line_analytic.append(line)
         
         # SPH methods (colored markers)
-        for method in available_methods:
-            scatter = ax.scatter([], [], s=40, alpha=0.6, 
-                               label=method.upper(), 
+        for method in method_offsets:
+            scatter = ax.scatter([], [], s=40, alpha=0.6,
+                               label=method.upper(),
                                marker=markers.get(method, 'o'),
                                edgecolors='none',
                                c=colors.get(method, 'gray'))
@@ -103,47 +100,136 @@ def create_multi_method_animation(result_dirs, output_file, gamma=1.4):
     axes[1, 0].set_ylim(0, 1.2)   # Pressure
     axes[1, 1].set_ylim(0, 3.0)   # Energy
     
-    time_text = fig.text(0.5, 0.96, '', ha='center', fontsize=14, fontweight='bold')
+    time_text = fig.text(0.5, 0.955, '', ha='center', va='top', fontsize=14, fontweight='bold')
     
-    def init():
-        for line in line_analytic:
-            line.set_data([], [])
-        for method in available_methods:
-            for scatter in scatters_methods[method]:
-                scatter.set_offsets(np.empty((0, 2)))
-        time_text.set_text('')
-        return line_analytic + [s for method in available_methods 
-                               for s in scatters_methods[method]] + [time_text]
+    # Time of the analytical solution currently drawn. Consecutive frames
+    # can share a time, and then the lines are left as they are
+    analytic_t = None
     
     def animate(frame):
-        # Load data for first available method to get time
-        first_method = list(available_methods.keys())[0]
-        t, _, _, _, _, _ = load_sph_data(available_methods[first_method][frame])
+        nonlocal analytic_t
+        t = times[frame]
         
         # Update analytical solution
-        rho_a, v_a, p_a, e_a = solver.shock_tube_solution(x_analytic, t)
-        line_analytic[0].set_data(x_analytic, rho_a)
-        line_analytic[1].set_data(x_analytic, v_a)
-        line_analytic[2].set_data(x_analytic, p_a)
-        line_analytic[3].set_data(x_analytic, e_a)
+        if t != analytic_t:
+            for line, values in zip(line_analytic, analytic[frame]):
+                line.set_data(x_analytic, values)
+            analytic_t = t
         
-        # Update all SPH methods
-        for method, files in available_methods.items():
-            if frame < len(files):
-                _, x, rho, v, p, e = load_sph_data(files[frame])
-                scatters_methods[method][0].set_offsets(np.c_[x, rho])
-                scatters_methods[method][1].set_offsets(np.c_[x, v])
-                scatters_methods[method][2].set_offsets(np.c_[x, p])
-                scatters_methods[method][3].set_offsets(np.c_[x, e])
+        # Update all SPH methods. A method with fewer snapshots keeps
+        # showing its last one
+        for method, frames in method_offsets.items():
+            offsets = frames[min(frame, len(frames) - 1)]
+            for scatter, panel_offsets in zip(scatters_methods[method], offsets):
+                scatter.set_offsets(panel_offsets)
         
         time_text.set_text(f't = {t:.5f}')
-        return (line_analytic + 
-                [s for method in available_methods for s in scatters_methods[method]] + 
-                [time_text])
+    
+    return fig, animate
+
+
+# Figure and update function of this process, set up by init_renderer()
+_renderer = None
+
+
+def init_renderer(*figure_args):
+    """Build this process's figure from build_figure(*figure_args)"""
+    global _renderer
+    _renderer = build_figure(*figure_args)
+
+
+def render_frame(frame):
+    """Draw one frame on this process's figure and return its RGBA bytes"""
+    fig, animate = _renderer
+    animate(frame)
+    fig.canvas.draw()
+    return bytes(fig.canvas.buffer_rgba())
+
+
+def render_frames(n_frames, figure_args):
+    """Yield the RGBA bytes of every frame in order
+    
+    Frames are independent, so they are drawn in worker processes, each
+    with its own copy of the figure. On a single core they are drawn here.
+    """
+    n_workers = os.cpu_count() or 1
+    if n_workers == 1:
+        yield from map(render_frame, range(n_frames))
+        return
+    
+    batch = RENDER_BATCH * n_workers
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_renderer,
+                             initargs=figure_args) as pool:
+        for start in range(0, n_frames, batch):
+            yield from pool.map(render_frame, range(start, min(start + batch, n_frames)))
+
+
+def create_multi_method_animation(result_dirs, output_file, gamma=1.4):
+    """Create animated comparison with all SPH methods overlapped
+    
+    Args:
+        result_dirs: Dict mapping method names to result directories
+        output_file: Output animation filename
+        gamma: Adiabatic index (default 1.4)
+    """
+    # Filter out methods that don't have data
+    available_methods = {}
+    for method, dir_path in result_dirs.items():
+        # One directory read per method; a missing directory has no data
+        try:
+            sph_files = sorted(Path(entry.path) for entry in os.scandir(dir_path)
+                               if entry.name.endswith('.dat') and entry.name != 'energy.dat')
+        except FileNotFoundError:
+            sph_files = []
+        if len(sph_files) > 0:
+            available_methods[method] = sph_files
+        else:
+            print(f"⚠ No data found for {method} in {dir_path} (skipping)")
+    
+    if len(available_methods) == 0:
+        print("Error: No data files found for any method")
+        return
+    
+    # Use the first available method to determine frame count and domain
+    first_method = list(available_methods.keys())[0]
+    n_frames = len(available_methods[first_method])
+    print(f"Creating multi-method comparison animation with {n_frames} frames")
+    print(f"Methods: {', '.join(available_methods.keys())}")
+    
+    # Every snapshot shown is parsed once, up front, in threads since it is
+    # mostly file I/O. Keyed by path
+    paths = {f for files in available_methods.values() for f in files[:n_frames]}
+    with ThreadPoolExecutor() as pool:
+        snapshots = dict(zip(paths, pool.map(load_sph_data, paths)))
+    
+    # Get domain from first method's first file
+    _, x_sample, _, _, _, _ = snapshots[available_methods[first_method][0]]
+    x_min, x_max = x_sample.min(), x_sample.max()
+    x_analytic = np.linspace(x_min, x_max, ANALYTIC_POINTS)
+    solver = SodShockTube(gamma=gamma)
+    
+    # Frame times come from the first method. The analytical solution only
+    # depends on t, so it is solved once per distinct time up front:
+    # analytic[frame] holds the density, velocity, pressure and energy rows
+    times = [snapshots[f][0] for f in available_methods[first_method]]
+    solutions = {}
+    for t in times:
+        if t not in solutions:
+            solutions[t] = solver.shock_tube_solution(x_analytic, t)
+    analytic = np.array([solutions[t] for t in times])
+    
+    # Scatter offsets of every snapshot of every method, built once so a
+    # frame only swaps in ready-made arrays (see build_figure)
+    method_offsets = {
+        method: [np.stack([np.column_stack((x, field)) for field in (rho, v, p, e)])
+                 for x, rho, v, p, e in (snapshots[f][1:] for f in files[:n_frames])]
+        for method, files in available_methods.items()
+    }
     
     print("Creating multi-method animation...")
-    anim = animation.FuncAnimation(fig, animate, init_func=init,
-                                   frames=n_frames, interval=100, blit=True)
+    figure_args = (method_offsets, times, analytic, x_analytic)
+    init_renderer(*figure_args)
+    frame_size = _renderer[0].canvas.get_width_height()
     
     output_path = Path(output_file)
     if not output_path.is_absolute():
@@ -151,9 +237,10 @@ def create_multi_method_animation(result_dirs, output_file, gamma=1.4):
         output_path.parent.mkdir(parents=True, exist_ok=True)
     
     print(f"Saving to {output_path}...")
-    Writer = animation.writers['ffmpeg']
-    writer = Writer(fps=10, bitrate=4000, codec='libx264')
-    anim.save(str(output_path), writer=writer, dpi=150)
+    # Fast x264 preset tuned for flat plot graphics
+    write_frames(render_frames(n_frames, figure_args), frame_size, str(output_path),
+                 fps=10, bitrate=4000, codec='libx264',
+                 extra_args=['-preset', 'veryfast', '-tune', 'animation'])
     print(f"Animation saved: {output_path}")
     plt.close()
 
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Create the SPH vs analytical animation of several methods in one run
+Does the work of the animate_*_vs_analytical.py scripts, importing once
+"""
+
+import argparse
+import os
+import matplotlib
+matplotlib.use('Agg')  # Non-interactive backend
+from concurrent.futures import ProcessPoolExecutor
+from shock_tube_animation_utils import create_animation
+
+# Method name -> (default output directory, plot label), as used by the
+# animate_<method>_vs_analytical.py scripts
+METHODS = {
+    'baseline': ('../results/baseline', 'Baseline (abd7353)'),
+    'modern': ('../results/modern', 'Modern (with ghosts)'),
+    'gsph': ('../results/gsph', 'GSPH'),
+    'disph': ('../results/disph', 'DISPH'),
+    'ssph': ('../results/ssph', 'SSPH'),
+}
+
+
+def animate_methods(jobs, gamma=1.4):
+    """Run create_animation for every (sph_dir, output_file, label) job
+
+    The animations are independent, so they are made in worker processes
+    that share this process's imports. On a single core they are made here.
+    """
+    n_workers = min(len(jobs), os.cpu_count() or 1)
+    if n_workers <= 1:
+        for sph_dir, output_file, label in jobs:
+            create_animation(sph_dir, output_file, gamma, label)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(create_animation, sph_dir, output_file, gamma, label)
+                   for sph_dir, output_file, label in jobs]
+        for future in futures:
+            future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Animate several SPH methods vs Analytical, one video each')
+    parser.add_argument('--methods', nargs='+', choices=list(METHODS),
+                        default=list(METHODS), help='Methods to animate')
+    for method, (default_dir, _) in METHODS.items():
+        parser.add_argument(f'--{method}', default=default_dir,
+                            help=f'{method.upper()} output directory')
+    parser.add_argument('--gamma', type=float, default=1.4,
+                        help='Adiabatic index')
+    args = parser.parse_args()
+
+    jobs = [(getattr(args, method), f'{method}_vs_analytical.mp4', METHODS[method][1])
+            for method in args.methods]
+    animate_methods(jobs, args.gamma)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,29 +3,61 @@
 Diagnostic script to analyze real and ghost particles near boundaries
 """
 
+import sys
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 
+# Columns used by the analysis
+# 1D layout: 0=x, 1=vx, 2=ax, 3=mass, 4=dens, 5=pres, 6=ene, 7=sml, 8=id, 9=neighbor, 10=alpha, 11=gradh, 12=type
+COLUMNS = {'x': 0, 'v': 1, 'rho': 4, 'p': 5, 'sml': 7}
+
+# Row format of the particle tables: index, the COLUMNS fields, distance to boundary
+TABLE_FMT = '%-4d %10.6f %10.6f %10.6f %10.6f %10.6f %12.6f'
+
 
 def load_all_particles(dat_file):
     """Load ALL particles including ghosts from .dat file
     
     Returns:
-        time, real_data, ghost_data
+        time, real_data, ghost_data (dicts of 1D column arrays, see COLUMNS)
     """
-    data = np.loadtxt(dat_file, comments='#')
+    # One open: the time header is the first line, and pandas' C parser
+    # (far faster than np.loadtxt) reads the body from where that left off.
+    # Every column is kept since the analysis indexes them all
     with open(dat_file, 'r') as f:
         time = float(f.readline().replace('#', '').strip())
+        data = pd.read_csv(f, sep=r'\s+', comment='#', header=None,
+                           engine='c').to_numpy()
     
-    # Column indices: 0=x, 1=v, 4=rho, 5=p, 6=e, 7=mass, 8=sml, -1=type
+    # Split on the type column (last) and keep each needed field as its
+    # own contiguous array, so the boundary filters scan one column
+    # rather than striding across whole rows
     is_ghost = data[:, -1] == 1
+    real_idx = np.flatnonzero(~is_ghost)
+    ghost_idx = np.flatnonzero(is_ghost)
     
-    real_data = data[~is_ghost]
-    ghost_data = data[is_ghost]
+    real_data = {name: data[real_idx, col] for name, col in COLUMNS.items()}
+    ghost_data = {name: data[ghost_idx, col] for name, col in COLUMNS.items()}
     
     return time, real_data, ghost_data
 
 
+def select_sorted(cols, mask):
+    """Return the particles of cols where mask holds, ordered by position"""
+    idx = np.flatnonzero(mask)
+    idx = idx[np.argsort(cols['x'][idx])]
+    return {name: values[idx] for name, values in cols.items()}
+
+
+def print_particle_table(cols, rows, boundary_x):
+    """Print the particles of cols selected by rows, one line each"""
+    fields = [cols[name][rows] for name in COLUMNS]
+    dist = np.abs(fields[0] - boundary_x)
+    table = np.column_stack([np.arange(len(dist)), *fields, dist])
+    np.savetxt(sys.stdout, table, fmt=TABLE_FMT)
+
+
 def analyze_boundary_region(real_data, ghost_data, boundary_x, side='left', window=0.1):
     """Analyze particles near a boundary
     
@@ -40,46 +72,38 @@ def analyze_boundary_region(real_data, ghost_data, boundary_x, side='left', wind
     print(f"ANALYZING {side.upper()} BOUNDARY (x = {boundary_x})")
     print(f"{'='*80}")
     
-    # Column indices for 1D: 0=x, 1=vx, 2=ax, 3=mass, 4=dens, 5=pres, 6=ene, 7=sml, 8=id, 9=neighbor, 10=alpha, 11=gradh, 12=type
-    
-    # Extract positions
-    real_x = real_data[:, 0]
-    ghost_x = ghost_data[:, 0]
-    
     # Find particles within window of boundary
+    real_x = real_data['x']
+    ghost_x = ghost_data['x']
     if side == 'left':
-        real_near = real_data[(real_x >= boundary_x) & (real_x <= boundary_x + window)]
-        ghost_near = ghost_data[(ghost_x >= boundary_x - window) & (ghost_x <= boundary_x)]
+        real_mask = (real_x >= boundary_x) & (real_x <= boundary_x + window)
+        ghost_mask = (ghost_x >= boundary_x - window) & (ghost_x <= boundary_x)
     else:  # right
-        real_near = real_data[(real_x <= boundary_x) & (real_x >= boundary_x - window)]
-        ghost_near = ghost_data[(ghost_x <= boundary_x + window) & (ghost_x >= boundary_x)]
+        real_mask = (real_x <= boundary_x) & (real_x >= boundary_x - window)
+        ghost_mask = (ghost_x <= boundary_x + window) & (ghost_x >= boundary_x)
     
-    print(f"\nReal particles near boundary: {len(real_near)}")
-    print(f"Ghost particles near boundary: {len(ghost_near)}")
+    # Sorted by position
+    real_near = select_sorted(real_data, real_mask)
+    ghost_near = select_sorted(ghost_data, ghost_mask)
+    n_real, n_ghost = len(real_near['x']), len(ghost_near['x'])
     
-    # Sort by position
-    real_near = real_near[np.argsort(real_near[:, 0])]
-    ghost_near = ghost_near[np.argsort(ghost_near[:, 0])]
+    print(f"\nReal particles near boundary: {n_real}")
+    print(f"Ghost particles near boundary: {n_ghost}")
     
     print(f"\n{'-'*80}")
-    print(f"REAL PARTICLES (closest {min(10, len(real_near))} to boundary):")
+    print(f"REAL PARTICLES (closest {min(10, n_real)} to boundary):")
     print(f"{'Idx':<4} {'x':>10} {'v':>10} {'rho':>10} {'p':>10} {'sml':>10} {'dist_to_bnd':>12}")
     print(f"{'-'*80}")
     
-    for i, p in enumerate(real_near[:10]):
-        x, v, rho, pres, sml = p[0], p[1], p[4], p[5], p[7]  # Fixed: sml is index 7
-        dist = abs(x - boundary_x)
-        print(f"{i:<4} {x:>10.6f} {v:>10.6f} {rho:>10.6f} {pres:>10.6f} {sml:>10.6f} {dist:>12.6f}")
+    print_particle_table(real_near, slice(None, 10), boundary_x)
     
     print(f"\n{'-'*80}")
-    print(f"GHOST PARTICLES (closest {min(10, len(ghost_near))} to boundary):")
+    print(f"GHOST PARTICLES (closest {min(10, n_ghost)} to boundary):")
     print(f"{'Idx':<4} {'x':>10} {'v':>10} {'rho':>10} {'p':>10} {'sml':>10} {'dist_to_bnd':>12}")
     print(f"{'-'*80}")
     
-    for i, p in enumerate(ghost_near[:10] if side == 'left' else ghost_near[-10:]):
-        x, v, rho, pres, sml = p[0], p[1], p[4], p[5], p[7]  # Fixed: sml is index 7
-        dist = abs(x - boundary_x)
-        print(f"{i:<4} {x:>10.6f} {v:>10.6f} {rho:>10.6f} {pres:>10.6f} {sml:>10.6f} {dist:>12.6f}")
+    rows = slice(None, 10) if side == 'left' else slice(-10, None)
+    print_particle_table(ghost_near, rows, boundary_x)
     
     # Check if ghosts mirror real particles correctly
     print(f"\n{'-'*80}")
@@ -87,37 +111,36 @@ def analyze_boundary_region(real_data, ghost_data, boundary_x, side='left', wind
     print(f"{'-'*80}")
     
     # For each ghost, find its mirrored real particle
-    if len(ghost_near) > 0 and len(real_near) > 0:
+    if n_ghost > 0 and n_real > 0:
         print(f"Checking if ghosts are correct mirrors of real particles...")
-        for i, ghost in enumerate(ghost_near[:5]):
-            ghost_x = ghost[0]
-            # Expected real particle position: 2*boundary - ghost_x
-            expected_real_x = 2 * boundary_x - ghost_x
-            
-            # Find closest real particle
-            closest_idx = np.argmin(np.abs(real_near[:, 0] - expected_real_x))
-            real_p = real_near[closest_idx]
-            real_x = real_p[0]
-            
-            x_error = abs(real_x - expected_real_x)
-            rho_match = abs(ghost[4] - real_p[4]) < 1e-6
-            v_sign = (ghost[1] * real_p[1]) < 0 if (abs(ghost[1]) > 1e-10 or abs(real_p[1]) > 1e-10) else True
-            
+        ghost = {name: values[:5] for name, values in ghost_near.items()}
+        # Expected real particle position: 2*boundary - ghost_x
+        expected_real_x = 2 * boundary_x - ghost['x']
+        
+        # Find the closest real particle to every expected position at once
+        closest_idx = np.abs(real_near['x'][None, :] - expected_real_x[:, None]).argmin(axis=1)
+        real_p = {name: values[closest_idx] for name, values in real_near.items()}
+        
+        x_error = np.abs(real_p['x'] - expected_real_x)
+        rho_match = np.abs(ghost['rho'] - real_p['rho']) < 1e-6
+        moving = (np.abs(ghost['v']) > 1e-10) | (np.abs(real_p['v']) > 1e-10)
+        v_sign = ~moving | (ghost['v'] * real_p['v'] < 0)
+        # Check kernel support overlap
+        kernel_support = 2.0 * real_p['sml']  # 2*sml for cubic spline
+        distance_between = np.abs(ghost['x'] - real_p['x'])
+        
+        for i in range(len(expected_real_x)):
             print(f"\nGhost #{i}:")
-            print(f"  Ghost pos: {ghost_x:>10.6f}")
-            print(f"  Expected real pos: {expected_real_x:>10.6f}")
-            print(f"  Actual real pos: {real_x:>10.6f}")
-            print(f"  Position error: {x_error:>10.6f}")
-            print(f"  Ghost rho: {ghost[4]:>10.6f}, Real rho: {real_p[4]:>10.6f} {'✓' if rho_match else '✗'}")
-            print(f"  Ghost v: {ghost[1]:>10.6f}, Real v: {real_p[1]:>10.6f} {'✓' if v_sign else '✗'}")
-            print(f"  Ghost sml: {ghost[7]:>10.6f}, Real sml: {real_p[7]:>10.6f}")
-            
-            # Check kernel support overlap
-            kernel_support = 2.0 * real_p[7]  # 2*sml for cubic spline
-            distance_between = abs(ghost_x - real_x)
-            print(f"  Kernel support (2*sml): {kernel_support:>10.6f}")
-            print(f"  Distance between ghost and real: {distance_between:>10.6f}")
-            print(f"  Ghost within real's kernel? {'YES' if distance_between < kernel_support else 'NO'}")
+            print(f"  Ghost pos: {ghost['x'][i]:>10.6f}")
+            print(f"  Expected real pos: {expected_real_x[i]:>10.6f}")
+            print(f"  Actual real pos: {real_p['x'][i]:>10.6f}")
+            print(f"  Position error: {x_error[i]:>10.6f}")
+            print(f"  Ghost rho: {ghost['rho'][i]:>10.6f}, Real rho: {real_p['rho'][i]:>10.6f} {'✓' if rho_match[i] else '✗'}")
+            print(f"  Ghost v: {ghost['v'][i]:>10.6f}, Real v: {real_p['v'][i]:>10.6f} {'✓' if v_sign[i] else '✗'}")
+            print(f"  Ghost sml: {ghost['sml'][i]:>10.6f}, Real sml: {real_p['sml'][i]:>10.6f}")
+            print(f"  Kernel support (2*sml): {kernel_support[i]:>10.6f}")
+            print(f"  Distance between ghost and real: {distance_between[i]:>10.6f}")
+            print(f"  Ghost within real's kernel? {'YES' if distance_between[i] < kernel_support[i] else 'NO'}")
     
     return real_near, ghost_near
 
@@ -128,8 +151,8 @@ def visualize_boundary(real_near, ghost_near, boundary_x, side, time):
     
     # Position diagram
     ax1.axvline(boundary_x, color='red', linestyle='--', linewidth=2, label='Boundary', alpha=0.7)
-    ax1.scatter(real_near[:, 0], real_near[:, 4], s=50, alpha=0.7, label='Real particles', marker='o')
-    ax1.scatter(ghost_near[:, 0], ghost_near[:, 4], s=50, alpha=0.7, label='Ghost particles', marker='s')
+    ax1.scatter(real_near['x'], real_near['rho'], s=50, alpha=0.7, label='Real particles', marker='o')
+    ax1.scatter(ghost_near['x'], ghost_near['rho'], s=50, alpha=0.7, label='Ghost particles', marker='s')
     
     ax1.set_xlabel('Position x')
     ax1.set_ylabel('Density ρ')
@@ -141,16 +164,14 @@ def visualize_boundary(real_near, ghost_near, boundary_x, side, time):
     ax2.axvline(boundary_x, color='red', linestyle='--', linewidth=2, label='Boundary', alpha=0.7)
     
     # Plot kernel support for first few real particles
-    for i, p in enumerate(real_near[:5]):
-        x, sml = p[0], p[7]  # Fixed: sml is index 7
+    for i, (x, sml) in enumerate(zip(real_near['x'][:5], real_near['sml'][:5])):
         kernel_support = 2.0 * sml
         ax2.plot([x - kernel_support, x + kernel_support], [i, i], 'o-', alpha=0.6, label=f'Real p{i} support')
         ax2.scatter([x], [i], s=100, marker='o', zorder=3)
     
     # Plot ghost positions
-    for i, p in enumerate(ghost_near[:5]):
-        x = p[0]
-        offset = len(real_near[:5]) + i
+    for i, x in enumerate(ghost_near['x'][:5]):
+        offset = len(real_near['x'][:5]) + i
         ax2.scatter([x], [offset], s=100, marker='s', zorder=3, label=f'Ghost p{i}')
     
     ax2.set_xlabel('Position x')
@@ -164,8 +185,6 @@ def visualize_boundary(real_near, ghost_near, boundary_x, side, time):
 
 
 def main():
-    import sys
-    
     if len(sys.argv) > 1:
         dat_file = sys.argv[1]
     else:
@@ -176,8 +195,8 @@ def main():
     time, real_data, ghost_data = load_all_particles(dat_file)
     
     print(f"\nTime: {time}")
-    print(f"Total real particles: {len(real_data)}")
-    print(f"Total ghost particles: {len(ghost_data)}")
+    print(f"Total real particles: {len(real_data['x'])}")
+    print(f"Total ghost particles: {len(ghost_data['x'])}")
     
     # Analyze left boundary
     left_real, left_ghost = analyze_boundary_region(
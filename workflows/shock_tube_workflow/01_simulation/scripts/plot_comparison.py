@@ -7,6 +7,7 @@ import argparse
 import sys
 from pathlib import Path
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 
 # Import the analytical solution from animation utils
@@ -16,17 +17,22 @@ from shock_tube_animation_utils import SodShockTube
 def load_snapshot(snapshot_file):
     """Load particle data from a snapshot CSV file"""
     try:
-        data = np.loadtxt(snapshot_file, delimiter=',', skiprows=1)
+        # Only parse the four columns used (x, density, velocity_x, pressure),
+        # with pandas' C parser, in single precision (plenty for plotting)
+        data = pd.read_csv(snapshot_file, skiprows=1, header=None,
+                           usecols=[0, 1, 2, 3], dtype=np.float32,
+                           engine='c').to_numpy()
         if data.size == 0:
             return None
         
-        # Extract columns: x, density, velocity_x, pressure
         x = data[:, 0]
         density = data[:, 1]
         velocity_x = data[:, 2]
         pressure = data[:, 3]
         
         return x, density, velocity_x, pressure
+    except pd.errors.EmptyDataError:
+        return None
     except Exception as e:
         print(f"Warning: Could not load {snapshot_file}: {e}")
         return None
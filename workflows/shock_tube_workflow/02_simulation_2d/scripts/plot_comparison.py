@@ -7,6 +7,7 @@ import argparse
 import sys
 from pathlib import Path
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 
 # Import the analytical solution from animation utils
@@ -16,35 +17,41 @@ from shock_tube_animation_utils import SodShockTube
 def load_snapshot(snapshot_file):
     """Load particle data from a snapshot CSV file"""
     try:
-        data = np.loadtxt(snapshot_file, delimiter=',', skiprows=1)
+        # For 2D the columns are x, y, density, velocity_x, velocity_y, pressure.
+        # Only x, density, velocity_x and pressure are used, so only those
+        # are parsed, with pandas' C parser in single precision (plenty
+        # for plotting)
+        data = pd.read_csv(snapshot_file, skiprows=1, header=None,
+                           usecols=[0, 2, 3, 5], dtype=np.float32,
+                           engine='c').to_numpy()
         if data.size == 0:
             return None
         
-        # For 2D: Extract columns: x, y, density, velocity_x, velocity_y, pressure
         # We'll average along y-direction to get 1D profiles for comparison
         x = data[:, 0]
-        y = data[:, 1]
-        density = data[:, 2]
-        velocity_x = data[:, 3]
-        velocity_y = data[:, 4]
-        pressure = data[:, 5]
+        density = data[:, 1]
+        velocity_x = data[:, 2]
+        pressure = data[:, 3]
         
-        # Average quantities along y-direction by binning x positions
+        # Average quantities along y-direction by binning x positions. Each
+        # particle's bin [x_bins[i], x_bins[i+1]) is found once, and every
+        # field is summed per bin in one bincount pass. Empty bins read 0
         x_bins = np.linspace(x.min(), x.max(), 100)
         x_centers = 0.5 * (x_bins[:-1] + x_bins[1:])
+        n_bins = len(x_centers)
         
-        density_avg = np.zeros_like(x_centers)
-        velocity_avg = np.zeros_like(x_centers)
-        pressure_avg = np.zeros_like(x_centers)
+        bins = np.searchsorted(x_bins, x, side='right') - 1
+        inside = bins < n_bins  # x == x.max() lies in no half-open bin
+        bins = bins[inside]
+        counts = np.bincount(bins, minlength=n_bins)
         
-        for i in range(len(x_centers)):
-            mask = (x >= x_bins[i]) & (x < x_bins[i+1])
-            if np.any(mask):
-                density_avg[i] = np.mean(density[mask])
-                velocity_avg[i] = np.mean(velocity_x[mask])
-                pressure_avg[i] = np.mean(pressure[mask])
+        def bin_mean(values):
+            sums = np.bincount(bins, weights=values[inside], minlength=n_bins)
+            return np.divide(sums, counts, out=np.zeros(n_bins), where=counts > 0)
         
-        return x_centers, density_avg, velocity_avg, pressure_avg
+        return x_centers, bin_mean(density), bin_mean(velocity_x), bin_mean(pressure)
+    except pd.errors.EmptyDataError:
+        return None
     except Exception as e:
         print(f"Warning: Could not load {snapshot_file}: {e}")
         return None
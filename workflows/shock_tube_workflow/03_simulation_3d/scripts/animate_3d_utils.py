@@ -4,11 +4,18 @@ Shared utilities for 3D shock tube animation scripts
 For 3D simulations, we visualize slice views and statistical summaries
 """
 
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 from pathlib import Path
 
+# Shared video writer lives in workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'common'))
+from ffmpeg_pipe import write_animation
+
 
 def load_sph_data_3d(csv_file):
     """Load 3D SPH simulation data from CSV file
@@ -21,8 +28,11 @@ def load_sph_data_3d(csv_file):
     """
     import pandas as pd
     
-    # Read CSV file
-    df = pd.read_csv(csv_file)
+    # Read CSV file. Only the plotted fields and the particle type are
+    # parsed, in single precision (plenty for plotting)
+    columns = ('pos_x', 'pos_y', 'pos_z', 'vel_x', 'vel_y', 'vel_z',
+               'density', 'pressure', 'energy', 'type')
+    df = pd.read_csv(csv_file, usecols=lambda c: c in columns, dtype=np.float32)
     
     # Filter real particles (type == 0)
     df_real = df[df['type'] == 0]
@@ -45,6 +55,32 @@ def load_sph_data_3d(csv_file):
     return time, x, y, z, rho, vx, vy, vz, p, e
 
 
+def mid_slice(coord, half_width):
+    """Return the indices of the particles within half_width of the mid-plane of coord
+    
+    The indices are found once and gathered from every field of the slice,
+    rather than rescanning a boolean mask per field
+    """
+    mid = (coord.min() + coord.max()) / 2
+    return np.flatnonzero(np.abs(coord - mid) < half_width)
+
+
+def load_slices_3d(csv_file):
+    """Load a 3D snapshot and cut out its three mid-plane slices
+    
+    Returns:
+        time, slices: slices holds the (offsets, rho) of the XY (mid z),
+        XZ (mid y) and YZ (mid x) planes
+    """
+    t, x, y, z, rho, vx, vy, vz, p, e = load_sph_data_3d(csv_file)
+    slices = []
+    for u, w, idx in ((x, y, mid_slice(z, 0.05)),
+                      (x, z, mid_slice(y, 0.05)),
+                      (y, z, mid_slice(x, 0.1))):
+        slices.append((np.c_[u[idx], w[idx]], rho[idx]))
+    return t, slices
+
+
 def create_animation_3d(sph_dir, output_file, gamma=1.4, method_name='SPH'):
     """Create animated visualization of 3D SPH simulation
     
@@ -103,42 +139,25 @@ def create_animation_3d(sph_dir, output_file, gamma=1.4, method_name='SPH'):
     for i, scatter in enumerate(scatters):
         cbar = plt.colorbar(scatter, ax=axes[i], label='Density')
     
-    time_text = fig.text(0.5, 0.95, '', ha='center', fontsize=14, fontweight='bold')
+    time_text = fig.text(0.5, 0.93, '', ha='center', va='top', fontsize=14, fontweight='bold')
     
-    def init():
-        for scatter in scatters:
-            scatter.set_offsets(np.empty((0, 2)))
-            scatter.set_array(np.array([]))
-        time_text.set_text('')
-        return scatters + [time_text]
+    # Every snapshot is parsed and sliced up front, in threads since it is
+    # mostly file I/O. Only the slices are kept, so memory stays small
+    with ThreadPoolExecutor() as pool:
+        frames_data = list(pool.map(load_slices_3d, sph_files))
     
     def animate(frame):
-        t, x, y, z, rho, vx, vy, vz, p, e = load_sph_data_3d(sph_files[frame])
-        
-        # XY plane (mid z-slice)
-        z_mid = (z.min() + z.max()) / 2
-        mask_xy = np.abs(z - z_mid) < 0.05
-        scatters[0].set_offsets(np.c_[x[mask_xy], y[mask_xy]])
-        scatters[0].set_array(rho[mask_xy])
-        
-        # XZ plane (mid y-slice)
-        y_mid = (y.min() + y.max()) / 2
-        mask_xz = np.abs(y - y_mid) < 0.05
-        scatters[1].set_offsets(np.c_[x[mask_xz], z[mask_xz]])
-        scatters[1].set_array(rho[mask_xz])
+        t, slices = frames_data[frame]
         
-        # YZ plane (mid x-slice)
-        x_mid = (x.min() + x.max()) / 2
-        mask_yz = np.abs(x - x_mid) < 0.1
-        scatters[2].set_offsets(np.c_[y[mask_yz], z[mask_yz]])
-        scatters[2].set_array(rho[mask_yz])
+        # XY, XZ and YZ planes
+        for scatter, (offsets, rho) in zip(scatters, slices):
+            scatter.set_offsets(offsets)
+            scatter.set_array(rho)
         
         time_text.set_text(f't = {t:.5f}')
         return scatters + [time_text]
     
     print("Creating 3D animation...")
-    anim = animation.FuncAnimation(fig, animate, init_func=init,
-                                   frames=n_frames, interval=100, blit=True)
     
     output_path = Path(output_file)
     if not output_path.is_absolute():
@@ -146,8 +165,10 @@ def create_animation_3d(sph_dir, output_file, gamma=1.4, method_name='SPH'):
         output_path.parent.mkdir(parents=True, exist_ok=True)
     
     print(f"Saving to {output_path}...")
-    Writer = animation.writers['ffmpeg']
-    writer = Writer(fps=10, bitrate=3000, codec='libx264')
-    anim.save(str(output_path), writer=writer, dpi=150)
+    # Frames are piped to ffmpeg as raw RGBA, with a fast x264 preset tuned
+    # for flat plot graphics
+    write_animation(fig, animate, n_frames, str(output_path), fps=10,
+                    bitrate=3000, dpi=100,
+                    extra_args=['-preset', 'veryfast', '-tune', 'animation'])
     print(f"Animation saved: {output_path}")
     plt.close()
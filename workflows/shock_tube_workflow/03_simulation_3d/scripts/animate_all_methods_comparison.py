@@ -5,11 +5,17 @@ Shows slice views with all methods overlaid
 """
 
 import argparse
-import numpy as np
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 from pathlib import Path
-from animate_3d_utils import load_sph_data_3d
+from animate_3d_utils import load_slices_3d
+
+# Shared video writer lives in workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', 'common'))
+from ffmpeg_pipe import write_animation
 
 
 def create_multi_method_animation_3d(result_dirs, output_file, gamma=1.4):
@@ -23,7 +29,12 @@ def create_multi_method_animation_3d(result_dirs, output_file, gamma=1.4):
     # Filter out methods that don't have data
     available_methods = {}
     for method, dir_path in result_dirs.items():
-        sph_files = sorted([f for f in Path(dir_path).glob("*.dat") if f.name != 'energy.dat'])
+        # One directory read per method; a missing directory has no data
+        try:
+            sph_files = sorted(Path(entry.path) for entry in os.scandir(dir_path)
+                               if entry.name.endswith('.dat') and entry.name != 'energy.dat')
+        except FileNotFoundError:
+            sph_files = []
         if len(sph_files) > 0:
             available_methods[method] = sph_files
         else:
@@ -97,46 +108,29 @@ def create_multi_method_animation_3d(result_dirs, output_file, gamma=1.4):
         else:
             ax.set_ylim(0, 0.5)
     
-    time_text = fig.text(0.5, 0.96, '', ha='center', fontsize=14, fontweight='bold')
+    time_text = fig.text(0.5, 0.93, '', ha='center', va='top', fontsize=14, fontweight='bold')
     
-    def init():
-        for method in available_methods:
-            for scatter in scatters[method]:
-                scatter.set_offsets(np.empty((0, 2)))
-        time_text.set_text('')
-        return [s for method in available_methods for s in scatters[method]] + [time_text]
+    # Every snapshot shown is parsed and sliced up front, in threads since
+    # it is mostly file I/O. Only the slices are kept
+    with ThreadPoolExecutor() as pool:
+        frames_data = {method: list(pool.map(load_slices_3d, files[:n_frames]))
+                       for method, files in available_methods.items()}
     
     def animate(frame):
-        # Get time from first method
-        first_method = list(available_methods.keys())[0]
-        t, _, _, _, _, _, _, _, _, _ = load_sph_data_3d(available_methods[first_method][frame])
+        # Frame time from first method
+        t, _ = frames_data[first_method][frame]
         
-        # Update all methods
-        for method, files in available_methods.items():
-            if frame < len(files):
-                _, x, y, z, rho, vx, vy, vz, p, e = load_sph_data_3d(files[frame])
-                
-                # XY plane (mid z-slice)
-                z_mid = (z.min() + z.max()) / 2
-                mask_xy = np.abs(z - z_mid) < 0.05
-                scatters[method][0].set_offsets(np.c_[x[mask_xy], y[mask_xy]])
-                
-                # XZ plane (mid y-slice)
-                y_mid = (y.min() + y.max()) / 2
-                mask_xz = np.abs(y - y_mid) < 0.05
-                scatters[method][1].set_offsets(np.c_[x[mask_xz], z[mask_xz]])
-                
-                # YZ plane (mid x-slice)
-                x_mid = (x.min() + x.max()) / 2
-                mask_yz = np.abs(x - x_mid) < 0.1
-                scatters[method][2].set_offsets(np.c_[y[mask_yz], z[mask_yz]])
+        # Update all methods (XY, XZ and YZ planes)
+        for method, method_frames in frames_data.items():
+            if frame < len(method_frames):
+                _, slices = method_frames[frame]
+                for scatter, (offsets, _) in zip(scatters[method], slices):
+                    scatter.set_offsets(offsets)
         
         time_text.set_text(f't = {t:.5f}')
         return [s for method in available_methods for s in scatters[method]] + [time_text]
     
     print("Creating 3D multi-method animation...")
-    anim = animation.FuncAnimation(fig, animate, init_func=init,
-                                   frames=n_frames, interval=100, blit=True)
     
     output_path = Path(output_file)
     if not output_path.is_absolute():
@@ -144,9 +138,11 @@ def create_multi_method_animation_3d(result_dirs, output_file, gamma=1.4):
         output_path.parent.mkdir(parents=True, exist_ok=True)
     
     print(f"Saving to {output_path}...")
-    Writer = animation.writers['ffmpeg']
-    writer = Writer(fps=10, bitrate=4000, codec='libx264')
-    anim.save(str(output_path), writer=writer, dpi=150)
+    # Frames are piped to ffmpeg as raw RGBA, with a fast x264 preset tuned
+    # for flat plot graphics
+    write_animation(fig, animate, n_frames, str(output_path), fps=10,
+                    bitrate=4000, dpi=100,
+                    extra_args=['-preset', 'veryfast', '-tune', 'animation'])
     print(f"Animation saved: {output_path}")
     plt.close()
 
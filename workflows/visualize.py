@@ -5,13 +5,22 @@ Generates plots and animations from JSON output files
 """
 
 import json
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 from pathlib import Path
 import argparse
 from typing import List, Dict, Tuple
 
+# Shared video writer lives in workflows/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'common'))
+from ffmpeg_pipe import write_animation
+
+# Frames are piped to ffmpeg as raw RGBA and encoded at constant quality
+# (CRF) with a fast x264 preset tuned for flat plot graphics
+FFMPEG_ARGS = ['-preset', 'veryfast', '-tune', 'animation', '-crf', '23']
+
 class SPHVisualizer:
     def __init__(self, output_dir: str, dimension: int):
         self.output_dir = Path(output_dir)
@@ -91,7 +100,7 @@ class SPHVisualizer:
             'density': dens,
             'pressure': pres,
             'energy': ene,
-            'velocity': np.sqrt(vel[:, 0]**2 + vel[:, 1]**2)
+            'velocity': np.hypot(vel[:, 0], vel[:, 1])
         }
         
         values = quantity_map.get(quantity, dens)
@@ -149,17 +158,26 @@ class SPHVisualizer:
         
         title = fig.suptitle('', fontsize=14)
         
+        # Scratch (x, field) offsets of the four panels. set_offsets copies
+        # its input, so the buffer is refilled every frame and only
+        # reallocated when the particle count changes
+        scatters = (scatter_dens, scatter_vel, scatter_pres, scatter_ene)
+        offsets = np.empty((4, 0, 2))
+        
         def update(frame):
+            nonlocal offsets
             pos, vel, dens, pres, ene = self.get_particle_data(frame)
             time = self.data[frame]['time']
             
             x = pos[:, 0]
             vx = vel[:, 0]
             
-            scatter_dens.set_offsets(np.c_[x, dens])
-            scatter_vel.set_offsets(np.c_[x, vx])
-            scatter_pres.set_offsets(np.c_[x, pres])
-            scatter_ene.set_offsets(np.c_[x, ene])
+            if offsets.shape[1] != len(x):
+                offsets = np.empty((4, len(x), 2))
+            offsets[:, :, 0] = x
+            offsets[:, :, 1] = (dens, vx, pres, ene)
+            for scatter, panel_offsets in zip(scatters, offsets):
+                scatter.set_offsets(panel_offsets)
             
             # Update y-limits
             axes[0, 0].set_ylim(dens.min() * 0.9, dens.max() * 1.1)
@@ -171,10 +189,8 @@ class SPHVisualizer:
             title.set_text(f't = {time:.4f}')
             return scatter_dens, scatter_vel, scatter_pres, scatter_ene, title
         
-        anim = animation.FuncAnimation(fig, update, frames=len(self.data),
-                                      interval=100, blit=False)
-        
-        anim.save(output_file, writer='ffmpeg', fps=10, dpi=100)
+        write_animation(fig, update, len(self.data), output_file, fps=10,
+                        bitrate=None, dpi=100, extra_args=FFMPEG_ARGS)
         print(f"Animation saved: {output_file}")
         plt.close()
     
@@ -191,7 +207,7 @@ class SPHVisualizer:
             'density': dens,
             'pressure': pres,
             'energy': ene,
-            'velocity': np.sqrt(vel[:, 0]**2 + vel[:, 1]**2)
+            'velocity': np.hypot(vel[:, 0], vel[:, 1])
         }
         
         values = quantity_map.get(quantity, dens)
@@ -213,20 +229,17 @@ class SPHVisualizer:
             pos, vel, dens, pres, ene = self.get_particle_data(frame)
             time = self.data[frame]['time']
             
-            x, y = pos[:, 0], pos[:, 1]
             values = quantity_map.get(quantity, dens)
             
-            scatter.set_offsets(np.c_[x, y])
+            scatter.set_offsets(pos[:, :2])  # (x, y) columns, no copy
             scatter.set_array(values)
             scatter.set_clim(values.min(), values.max())
             
             title.set_text(f'{quantity.capitalize()} at t = {time:.4f}')
             return scatter, title
         
-        anim = animation.FuncAnimation(fig, update, frames=len(self.data),
-                                      interval=100, blit=False)
-        
-        anim.save(output_file, writer='ffmpeg', fps=10, dpi=100)
+        write_animation(fig, update, len(self.data), output_file, fps=10,
+                        bitrate=None, dpi=100, extra_args=FFMPEG_ARGS)
         print(f"Animation saved: {output_file}")
         plt.close()
 